@@ -0,0 +1,56 @@
+"""
+Per-email CPU and allocations: rebuilding the message on every send vs the cached skeleton.
+
+    python -m benchmarks.bench_email_templates --number 2000
+"""
+import argparse
+import timeit
+import tracemalloc
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+import mail_templates
+
+SENDER = "sender@example.com"
+TO = ["user@example.com"]
+THEME, TEXT = mail_templates.MESSAGES[0]
+
+
+def rebuild(code):
+    html = mail_templates.template.html(TEXT, code)
+    msg = MIMEMultipart()
+    msg['From'] = SENDER
+    msg['To'] = ', '.join(TO)
+    msg['Subject'] = THEME
+    msg.attach(MIMEText(html, 'html'))
+    return msg.as_string()
+
+
+def cached(code):
+    return mail_templates.render(TO, THEME, TEXT, code, SENDER)
+
+
+def allocations(fn):
+    tracemalloc.start()
+    fn("1234")
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    return peak, blocks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    mail_templates.preload(SENDER)
+    for name, fn in (("rebuild", rebuild), ("cached", cached)):
+        seconds = timeit.timeit(lambda: fn("1234"), number=args.number)
+        peak, blocks = allocations(fn)
+        print(f"{name:8} {seconds / args.number * 1e6:9.1f} us/email  peak={peak / 1024:7.1f} KiB  live blocks={blocks}")
+
+
+if __name__ == '__main__':
+    main()
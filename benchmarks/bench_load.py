@@ -0,0 +1,228 @@
+"""
+End-to-end load test of the app with local stand-ins for Postgres, MinIO and SMTP.
+
+Runs main.app in process through httpx's ASGI transport against a local database (a fresh
+SQLite file by default, or any --database-url such as a local Postgres), with the in-memory
+object store and SMTP sink from benchmarks.stand_ins. Simulated clients keep picking scenarios
+from a weighted mix until the duration is over; throughput and p50/p95/p99 per endpoint are
+printed and, with --output, written as JSON so runs can be compared. Clients and app share one
+event loop, so the latencies include the client's own overhead.
+
+    python -m benchmarks.bench_load --concurrency 20 --duration 30 --output load.json
+    python -m benchmarks.bench_load --mix login=1,get_me=4,number=4 --database-url postgresql+asyncpg://...
+
+Scenarios: signup (signup -> confirm with the mailed code), login, get_me, videos, faqs, number.
+Needs the packages in requirements-dev.txt (httpx, and aiosqlite for the default database).
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks import stand_ins
+from benchmarks.bench_signup_smtp import percentile
+
+DEFAULT_MIX = "signup=1,login=1,get_me=4,videos=3,faqs=3,number=4"
+PASSWORD = "load-test-password"
+PAGE = 10
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception:
+            self.errors[f"{method} {path}"] += 1
+            raise
+        self.latencies[f"{method} {path}"].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[f"{method} {path}"] += 1
+        return response
+
+
+class Load:
+    """Shared state of one run: confirmed users with their tokens, and content sizes."""
+
+    def __init__(self, recorder, videos, faqs):
+        self.recorder = recorder
+        self.video_count = videos
+        self.faq_count = faqs
+        self.users = []
+        self._emails = itertools.count()
+
+    def auth(self):
+        email, token = random.choice(self.users)
+        return {"Authorization": f"Bearer {token}"}
+
+    async def signup(self, client):
+        email = f"load{next(self._emails)}@example.com"
+        response = await self.recorder.request(client, "POST", "/signup/",
+                                               json={"name": "Load", "email": email, "password": PASSWORD})
+        if response.status_code != 201:
+            return
+        # The code is mailed from a background thread; waiting for it is the user reading their mail
+        code = None
+        for _ in range(1000):
+            code = stand_ins.mail.code_for(email)
+            if code:
+                break
+            await asyncio.sleep(0.005)
+        response = await self.recorder.request(client, "POST", "/signup/confirm", json={"email": email, "code": code})
+        if response.status_code == 201:
+            self.users.append((email, response.json()["token"]))
+
+    async def login(self, client):
+        email, _ = random.choice(self.users)
+        await self.recorder.request(client, "POST", "/login/", json={"email": email, "password": PASSWORD})
+
+    async def get_me(self, client):
+        await self.recorder.request(client, "GET", "/get-me/", headers=self.auth())
+
+    async def videos(self, client):
+        params = {"limit": PAGE, "offset": random.randrange(max(self.video_count - PAGE, 1))}
+        await self.recorder.request(client, "GET", "/videos/", params=params, headers=self.auth())
+
+    async def faqs(self, client):
+        params = {"limit": PAGE, "offset": random.randrange(max(self.faq_count - PAGE, 1))}
+        await self.recorder.request(client, "GET", "/faqs/", params=params, headers=self.auth())
+
+    async def number(self, client):
+        date = datetime.date(1950, 1, 1) + datetime.timedelta(days=random.randrange(60 * 365))
+        await self.recorder.request(client, "GET", "/number/", params={"date": date.isoformat()}, headers=self.auth())
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if not callable(getattr(Load, name.strip(), None)):
+            raise SystemExit(f"Unknown scenario: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def seed(content):
+    """Fills empty content tables, so the paging and number scenarios have something to read."""
+    from sqlalchemy import func, select
+    import database
+    import models
+    import numerology
+
+    async with database.SessionLocal() as db:
+        if not await db.scalar(select(func.count()).select_from(models.Numbers)):
+            db.add_all(models.Numbers(number=n, description_en=f"Number {n}", description_it=f"Numero {n}")
+                       for n in range(1, 34))
+        if not await db.scalar(select(func.count()).select_from(models.FaQ)):
+            db.add_all(models.FaQ(question_en=f"Question {i}", question_it=f"Domanda {i}",
+                                  answer_en=f"Answer {i}", answer_it=f"Risposta {i}") for i in range(content))
+        if not await db.scalar(select(func.count()).select_from(models.Videos)):
+            db.add_all(models.Videos(preview=f"preview{i}.png", title_en=f"Video {i}", title_it=f"Video {i}",
+                                     link=f"https://example.com/{i}") for i in range(content))
+        await db.commit()
+        counts = [await db.scalar(select(func.count()).select_from(model)) for model in (models.Videos, models.FaQ)]
+    await numerology.reload()
+    return counts
+
+
+async def run(args, mix):
+    import httpx
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        videos, faqs = await seed(args.content)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load") as client:
+            load = Load(Recorder(), videos, faqs)
+            for _ in range(args.users):
+                await load.signup(client)
+            if not load.users:
+                raise SystemExit("No user could sign up, check the database")
+
+            load.recorder = Recorder()
+            names, weights = list(mix), list(mix.values())
+            deadline = time.perf_counter() + args.duration
+
+            async def client_loop():
+                while time.perf_counter() < deadline:
+                    try:
+                        await getattr(load, random.choices(names, weights)[0])(client)
+                    except Exception as e:
+                        print(e)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+            return load.recorder, time.perf_counter() - start
+
+
+def summary(recorder, elapsed):
+    endpoints = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[name],
+            "throughput": len(latencies) / elapsed,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies) * 1000,
+        }
+    requests = sum(e["requests"] for e in endpoints.values())
+    return {
+        "elapsed_s": elapsed,
+        "requests": requests,
+        "errors": sum(recorder.errors.values()),
+        "throughput": requests / elapsed,
+        "endpoints": endpoints,
+    }
+
+
+def report(result):
+    print(f"{'endpoint':22} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:22} {e['requests']:8} {e['errors']:6} {e['throughput']:8.1f} "
+              f"{e['p50_ms']:8.1f} {e['p95_ms']:8.1f} {e['p99_ms']:8.1f}")
+    print(f"{'total':22} {result['requests']:8} {result['errors']:6} {result['throughput']:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,...")
+    parser.add_argument("--users", type=int, default=20, help="users signed up before the run")
+    parser.add_argument("--content", type=int, default=100, help="videos and FAQs seeded into empty tables")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    random.seed(args.seed)
+    if not args.database_url:
+        args.database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'load.sqlite')}"
+    stand_ins.install(args.database_url)
+
+    started = datetime.datetime.now().isoformat()
+    recorder, elapsed = asyncio.run(run(args, mix))
+    result = summary(recorder, elapsed)
+    report(result)
+    if args.output:
+        result["config"] = {**vars(args), "mix": mix, "started": started}
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Login throughput with PBKDF2 on the event loop vs in the hashing process pool.
+
+Runs a burst of concurrent password verifications while a ticker coroutine, standing in for
+token checks and content reads, measures how long the event loop is blocked.
+
+    python -m benchmarks.bench_login_hashing --logins 64 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from hashing import HashPool, password_digest
+
+
+async def run(pool, logins, digest):
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(pool.verify("secret-password", digest) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    assert all(results)
+    return elapsed, max(stalls, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    digest = password_digest("secret-password")
+    for name, pool in (("inline", HashPool(workers=0)), ("pooled", HashPool(workers=args.workers, queue=args.logins))):
+        if pool.workers:
+            asyncio.run(run(pool, pool.workers, digest))  # start the worker processes
+        elapsed, stall = asyncio.run(run(pool, args.logins, digest))
+        pool.shutdown()
+        print(f"{name:8} {args.logins / elapsed:8.1f} logins/s  longest event loop stall={stall * 1000:8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Microbenchmarks of the hot paths in auth, numerology, content paging and code verification,
+with a stored baseline and a regression gate.
+
+Each benchmark runs in isolation (database ones against a fresh SQLite file through
+benchmarks.stand_ins) and reports the median ops/sec over --repeat rounds of at least --min-time
+seconds, with the slowest and fastest round as its spread, plus the peak bytes one call allocates
+and the bytes left allocated per call, both from tracemalloc. With --save the results become the
+baseline. Otherwise they are compared with the baseline and the run exits with status 1 when a
+benchmark got slower than --tolerance allows and its rounds no longer overlap the baseline's, or
+when its peak allocation grew beyond --tolerance plus ALLOC_SLACK. The bytes kept per call are
+only reported: they depend on caches and the garbage collector more than on the code. Baselines
+are machine specific; save them on the machine that runs the gate.
+
+    python -m benchmarks.bench_micro --save
+    python -m benchmarks.bench_micro --tolerance 0.1
+    python -m benchmarks.bench_micro --filter otp --min-time 0.5
+
+Needs the packages in requirements-dev.txt (aiosqlite).
+"""
+import argparse
+import asyncio
+import datetime
+import inspect
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from benchmarks import stand_ins
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Peak allocation growth below this many bytes is noise, whatever the tolerance
+ALLOC_SLACK = 16 * 1024
+PASSWORD = "secret-password"
+
+
+def number_rows():
+    return [SimpleNamespace(id=n, number=n, description_en=f"Number {n}", description_it=f"Numero {n}")
+            for n in range(1, 34)]
+
+
+async def setup_database():
+    from sqlalchemy import insert
+    import database
+    import migrate
+    import models
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(migrate.upgrade)
+        await conn.execute(insert(models.Videos), [
+            {"preview": f"p{i}", "title_en": f"Video {i}", "title_it": f"Video {i}", "link": "l"} for i in range(100)])
+        await conn.execute(insert(models.FaQ), [
+            {"question_en": f"Q{i}", "question_it": f"D{i}", "answer_en": "A", "answer_it": "R"} for i in range(100)])
+    async with database.SessionLocal() as db:
+        user = models.User(name="Bench", email="bench@example.com", password="", status=True)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+def benchmarks(user_id, index_path):
+    """name -> zero-argument callable, sync or async, doing one operation."""
+    import crud
+    import database
+    import hashing
+    import models
+    import numerology
+    import otp
+
+    digest = hashing.password_digest(PASSWORD)
+    user = SimpleNamespace(password=digest)
+    dates = itertools.cycle([datetime.date(1960, 1, 1) + datetime.timedelta(days=i * 37) for i in range(1000)])
+    days = itertools.cycle(range(1, 32))
+    indexed = numerology.DateIndex.open(index_path)
+    unindexed = numerology.DateIndex()
+    memory_store = otp.MemoryStore()
+    database_store = otp.DatabaseStore()
+    claims = itertools.count()
+
+    def get_number(index):
+        def run():
+            numerology.date_index = index
+            return crud.get_number(next(dates))
+        return run
+
+    def page(get, table, cached, **kwargs):
+        async def run():
+            if not cached:
+                crud.read_cache.invalidate(table)
+            async with database.SessionLocal() as db:
+                return await get(db, limit=10, **kwargs)
+        return run
+
+    def otp_cycle(store):
+        async def run():
+            async with database.SessionLocal() as db:
+                code = await store.issue(db, user_id, "bench")
+                assert await store.verify(db, user_id, "bench", code) == otp.OK
+                await db.commit()
+        return run
+
+    async def claim_code_attempt():
+        async with database.SessionLocal() as db:
+            if next(claims) == 0:
+                await crud.create_code(db, user_id, "claim", int(otp.new_code()))
+            await crud.claim_code_attempt(db, user_id, "claim", max_attempts=sys.maxsize)
+            await db.commit()
+
+    return {
+        "hashing.hashed_password": lambda: hashing.hashed_password(PASSWORD),
+        "crud.verify_password": lambda: crud.verify_password(user, PASSWORD),
+        "crud._sum_of_digits": lambda: crud._sum_of_digits(next(days)),
+        "crud.get_number[index]": get_number(indexed),
+        "crud.get_number[no index]": get_number(unindexed),
+        "crud.get_videos[offset]": page(crud.get_videos, models.Videos.__tablename__, False, offset=50),
+        "crud.get_videos[cursor]": page(crud.get_videos, models.Videos.__tablename__, False, offset=None, after_id=50),
+        "crud.get_videos[cached]": page(crud.get_videos, models.Videos.__tablename__, True, offset=50),
+        "crud.get_questions[offset]": page(crud.get_questions, models.FaQ.__tablename__, False, offset=50),
+        "crud.get_questions[cursor]": page(crud.get_questions, models.FaQ.__tablename__, False, offset=None, after_id=50),
+        "crud.claim_code_attempt": claim_code_attempt,
+        "otp.MemoryStore[issue+verify]": otp_cycle(memory_store),
+        "otp.DatabaseStore[issue+verify]": otp_cycle(database_store),
+    }
+
+
+def _runner(fn, loop):
+    if inspect.iscoroutinefunction(fn):
+        async def calls(n):
+            for _ in range(n):
+                await fn()
+        return lambda n: loop.run_until_complete(calls(n))
+
+    def run(n):
+        for _ in range(n):
+            fn()
+    return run
+
+
+def _timed(run, n):
+    start = time.perf_counter()
+    run(n)
+    return time.perf_counter() - start
+
+
+def measure(fn, loop, min_time, repeat):
+    run = _runner(fn, loop)
+    run(1)
+    # Grow the number of calls until one round takes at least min_time
+    n = 1
+    elapsed = _timed(run, n)
+    while elapsed < min_time:
+        n = max(n * 2, int(n * min_time / max(elapsed, 1e-9) * 1.2))
+        elapsed = _timed(run, n)
+    rounds = [n / _timed(run, n) for _ in range(repeat)]
+
+    calls = min(n, 100)
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for _ in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            run(1)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        retained = (tracemalloc.get_traced_memory()[0] - start) / calls
+    finally:
+        tracemalloc.stop()
+    return {
+        "ops_per_sec": statistics.median(rounds),
+        "ops_min": min(rounds),
+        "ops_max": max(rounds),
+        "peak_bytes": peak,
+        "retained_bytes": max(retained, 0.0),
+    }
+
+
+def regressions(result, base, tolerance):
+    found = []
+    # Only a slowdown beyond the tolerance that also leaves the spread of both runs counts;
+    # baselines saved before the spread was recorded fall back to their single figure
+    if (result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance)
+            and result["ops_max"] < base.get("ops_min", base["ops_per_sec"])):
+        found.append("slower")
+    if result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance) + ALLOC_SLACK:
+        found.append("peak memory")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    stand_ins.install(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.sqlite')}")
+    import database
+    import numerology
+
+    index_path = os.path.join(workdir, "numbers.idx")
+    numerology.DateIndex.write(index_path, datetime.date(1900, 1, 1), datetime.date(2100, 12, 31))
+    numerology.install(number_rows())
+
+    loop = asyncio.new_event_loop()
+    user_id = loop.run_until_complete(setup_database())
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results, failed = {}, []
+    print(f"{'benchmark':34} {'ops/s':>12} {'spread':>7} {'baseline':>12} {'change':>8} {'peak KiB':>9} {'kept B':>8}")
+    for name, fn in benchmarks(user_id, index_path).items():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(fn, loop, args.min_time, args.repeat)
+        base = baseline.get(name)
+        spread = (result["ops_max"] - result["ops_min"]) / result["ops_per_sec"]
+        line = f"{name:34} {result['ops_per_sec']:12.1f} {spread:7.1%} "
+        if base:
+            line += f"{base['ops_per_sec']:12.1f} {result['ops_per_sec'] / base['ops_per_sec'] - 1:+8.1%} "
+        else:
+            line += f"{'-':>12} {'-':>8} "
+        line += f"{result['peak_bytes'] / 1024:9.1f} {result['retained_bytes']:8.0f}"
+        problems = regressions(result, base, args.tolerance) if base and not args.save else []
+        if problems:
+            failed.append(name)
+            line += "  REGRESSION: " + ", ".join(problems)
+        print(line)
+
+    loop.run_until_complete(database.engine.dispose())
+    loop.close()
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "created": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                # A filtered run only replaces the baselines it measured
+                "results": {**baseline, **results},
+            }, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif failed:
+        print(f"{len(failed)} benchmark(s) regressed beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+N single /number/ lookups vs one vectorized /number/batch pass.
+
+The single path repeats what GET /number/ does per date (strptime, crud.get_number, JSON
+encoding); the batch path is numerology.batch_numbers plus the streamed body. Both use the
+date index when numbers.idx has been built (python build_number_index.py).
+
+    python -m benchmarks.bench_number_batch --dates 5000
+"""
+import argparse
+import datetime
+import json
+import time
+from types import SimpleNamespace
+
+import crud
+import numerology
+
+
+def rows():
+    return [SimpleNamespace(id=n, number=n, description_en=f"Number {n}", description_it=f"Numero {n}") for n in range(1, 34)]
+
+
+def single(dates):
+    out = []
+    for date in dates:
+        valid_date = datetime.datetime.strptime(date, '%Y-%m-%d')
+        out.append(json.dumps(crud.get_number(valid_date, "en")))
+    return out
+
+
+def batch(dates):
+    table, positions = numerology.batch_numbers(dates, "en")
+    return b"".join(numerology.stream_json(table, positions))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dates", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    numerology.open_index()
+    numerology.install(rows())
+    start = datetime.date(2020, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(args.dates)]
+    assert json.loads(batch(dates)) == [json.loads(x) for x in single(dates)]
+
+    for name, fn in (("single", single), ("batch", batch)):
+        best = min(_timed(fn, dates) for _ in range(args.repeat))
+        print(f"{name:7} {best * 1000:8.2f} ms for {args.dates} dates  ({args.dates / best:12.0f} dates/s)")
+
+
+def _timed(fn, dates):
+    start = time.perf_counter()
+    fn(dates)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Signup latency while the SMTP server is slow.
+
+Simulates concurrent signup handlers on one event loop against an SMTP server that
+takes SMTP_DELAY seconds per handshake and per message, once sending inline (the old
+smtplib.SMTP_SSL-per-call path) and once through the pooled MailTransport.
+
+    python -m benchmarks.bench_signup_smtp --requests 200 --concurrency 20 --delay 0.2
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import smtp
+
+
+class SlowSMTP:
+    def __init__(self, delay):
+        self.delay = delay
+        time.sleep(delay)  # TLS handshake + login
+
+    def sendmail(self, sender, addressees, message):
+        time.sleep(self.delay)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(send, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def signup(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await asyncio.sleep(0.002)  # database work
+            send([f"user{i}@example.com"], code="1234")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(signup(i) for i in range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, elapsed):
+    print(f"{name:8} p50={statistics.median(latencies) * 1000:9.1f}ms "
+          f"p99={percentile(latencies, 99) * 1000:9.1f}ms "
+          f"throughput={len(latencies) / elapsed:8.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--pool-size", type=int, default=smtp.SMTP_POOL_SIZE)
+    args = parser.parse_args()
+
+    def inline(addressees, **kwargs):
+        server = SlowSMTP(args.delay)
+        server.sendmail(smtp.SMTP_USER, addressees, smtp.build_message(addressees, **kwargs))
+        server.quit()
+
+    requests = min(args.requests, 50)  # inline mode serializes everything
+    report("inline", *asyncio.run(run(inline, requests, args.concurrency)))
+
+    # Room for every request: this measures handler latency, not how many sends a full queue rejects
+    transport = smtp.MailTransport(smtp.SMTPPool(size=args.pool_size, factory=lambda: SlowSMTP(args.delay)),
+                                   queue=args.requests)
+    report("pooled", *asyncio.run(run(transport.send, args.requests, args.concurrency)))
+    started = time.perf_counter()
+    transport.close()
+    print(f"pooled transport drained its queue in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
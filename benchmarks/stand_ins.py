@@ -0,0 +1,130 @@
+"""
+Local stand-ins for the services the app talks to, so it can be benchmarked on one machine.
+
+install() must run before main (or database) is imported: it points DATABASE_URL at the given
+database, swaps MinIO for an in-memory object store and gives the mailer an SMTP sink. With a
+SQLite URL it also teaches the Postgres UUID columns to live in SQLite (needs aiosqlite, from
+requirements-dev.txt).
+"""
+import email
+import os
+import re
+import threading
+import uuid
+from io import BytesIO
+
+CODE_PATTERN = re.compile(r'user-select:all">(\d+)</div>')
+
+
+class ObjectStore:
+    """The part of the minio.Minio API used by minioClient, kept in a dict."""
+
+    def __init__(self, *args, **kwargs):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def bucket_exists(self, bucket):
+        return True
+
+    def make_bucket(self, bucket):
+        pass
+
+    def fput_object(self, bucket, name, path, content_type=None):
+        with open(path, "rb") as f:
+            self.put_object(bucket, name, f, -1, content_type=content_type)
+
+    def put_object(self, bucket, name, data, length, content_type=None, part_size=0, **kwargs):
+        body = data.read(length) if length >= 0 else data.read()
+        with self._lock:
+            self.objects[bucket, name] = body
+
+    def get_object(self, bucket, name):
+        response = BytesIO(self._get(bucket, name))
+        response.release_conn = lambda: None
+        return response
+
+    def stat_object(self, bucket, name):
+        return len(self._get(bucket, name))
+
+    def remove_object(self, bucket, name):
+        with self._lock:
+            self.objects.pop((bucket, name), None)
+
+    def get_presigned_url(self, method, bucket, name, expires=None):
+        return f"http://objects.local/{bucket}/{name}"
+
+    def _get(self, bucket, name):
+        from minio.error import S3Error
+
+        with self._lock:
+            body = self.objects.get((bucket, name))
+        if body is None:
+            raise S3Error("NoSuchKey", "Object does not exist", name, "", "", None)
+        return body
+
+
+class MailSink:
+    """SMTP connection factory for smtp.SMTPPool; keeps the last message sent to each address."""
+
+    def __init__(self):
+        self.messages = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def sendmail(self, sender, addressees, message):
+        with self._lock:
+            self.sent += 1
+            for address in addressees:
+                self.messages[address] = message
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def code_for(self, address):
+        """The verification code in the last message sent to `address`, or None."""
+        with self._lock:
+            message = self.messages.get(address)
+        if message is None:
+            return None
+        for part in email.message_from_string(message).walk():
+            if part.get_content_type() == "text/html":
+                match = CODE_PATTERN.search(part.get_payload(decode=True).decode("utf-8"))
+                return match.group(1) if match else None
+        return None
+
+
+mail = MailSink()
+
+
+def _sqlite_uuids():
+    from sqlalchemy.dialects.postgresql import UUID
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.sql.schema import ColumnDefault
+    import models
+
+    @compiles(UUID, "sqlite")
+    def _uuid(type_, compiler, **kw):
+        return "CHAR(32)"
+
+    # SQLite stores the ids as strings, so they are generated as strings too
+    for column in (models.User.__table__.c.id, models.Token.__table__.c.token, models.Request.__table__.c.id):
+        column.default = ColumnDefault(lambda: str(uuid.uuid4()))
+    for model in (models.Token, models.Code, models.Request):
+        model.__table__.c.user.type.as_uuid = False
+
+
+def install(database_url):
+    os.environ["DATABASE_URL"] = database_url
+    import minioClient
+    import smtp
+
+    minioClient.Minio = ObjectStore
+    smtp.mailer.pool.factory = mail
+    if database_url.startswith("sqlite"):
+        _sqlite_uuids()
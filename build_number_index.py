@@ -0,0 +1,23 @@
+import argparse
+import datetime
+import os
+
+from numerology import NUMBER_INDEX_PATH, DateIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute numerology digit sums for a range of dates")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=os.getenv("NUMBER_INDEX_START", "1900-01-01"))
+    parser.add_argument("--end", type=datetime.date.fromisoformat, default=os.getenv("NUMBER_INDEX_END", "2100-12-31"))
+    parser.add_argument("--output", default=NUMBER_INDEX_PATH)
+    args = parser.parse_args()
+
+    tmp = args.output + ".tmp"
+    DateIndex.write(tmp, args.start, args.end)
+    # Running workers keep their mapping of the old file
+    os.replace(tmp, args.output)
+    print(f"{args.output}: {args.start} .. {args.end}, {os.path.getsize(args.output)} bytes")
+
+
+if __name__ == '__main__':
+    main()
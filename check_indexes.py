@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import json
+import sys
+import uuid
+from sqlalchemy import delete, select, text, update
+import crud
+import models
+from database import engine
+
+USER = str(uuid.UUID(int=0))
+CUTOFF = datetime.datetime(2000, 1, 1)
+
+# Hot lookups from crud.py and the index each one must use
+CHECKS = (
+    ("get_code", select(models.Code).where(models.Code.user == USER, models.Code.step == "signup").order_by(
+        models.Code.id.desc()).limit(1), "ix_code_user_step_id"),
+    ("claim_code_attempt", update(models.Code).where(
+        models.Code.user == USER, models.Code.step == "signup", models.Code.attempts < 3,
+    ).values(attempts=models.Code.attempts + 1, update_on=models.Code.update_on), "ix_code_user_step_id"),
+    ("user_remove_tokens", delete(models.Token).where(models.Token.user == USER).returning(models.Token.token), "ix_token_user"),
+    ("get_request", select(models.Request).where(models.Request.id == USER, models.Request.user == USER), "request_pkey"),
+    ("delete_user cascade", delete(models.Request).where(models.Request.user == USER), "ix_request_user"),
+    ("reap tokens", crud.expired_batch(models.Token, models.Token.created_on, CUTOFF, 500), "ix_token_created_on"),
+    ("reap codes", crud.expired_batch(models.Code, models.Code.update_on, CUTOFF, 500), "ix_code_update_on"),
+    ("reap requests", crud.expired_batch(models.Request, models.Request.created_on, CUTOFF, 500), "ix_request_created_on"),
+)
+
+
+def _index_names(plan):
+    if isinstance(plan, dict):
+        if "Index Name" in plan:
+            yield plan["Index Name"]
+        for value in plan.values():
+            yield from _index_names(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _index_names(value)
+
+
+async def _explain(conn, statement):
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    if engine.dialect.name == "postgresql":
+        plan = (await conn.execute(text("EXPLAIN (FORMAT JSON) " + sql))).scalar()
+        return set(_index_names(json.loads(plan) if isinstance(plan, str) else plan)), plan
+    # SQLite names the index in the detail column, e.g. "SEARCH code USING INDEX ix_code_user_step_id (...)"
+    rows = (await conn.execute(text("EXPLAIN QUERY PLAN " + sql))).all()
+    details = [row[-1] for row in rows]
+    return {word for detail in details for word in detail.replace("(", " ").split()}, details
+
+
+async def main():
+    failed = 0
+    async with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            # Tables in a fresh database are tiny; make the planner show whether an index is usable at all
+            await conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, statement, index in CHECKS:
+            used, plan = await _explain(conn, statement)
+            if engine.dialect.name != "postgresql" and index.endswith("_pkey"):
+                # SQLite calls the primary key index of a non-integer key sqlite_autoindex_<table>_1
+                index = f"sqlite_autoindex_{index[:-len('_pkey')]}_1"
+            ok = index in used
+            failed += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name}: expected {index}")
+            if not ok:
+                print(f"     plan: {plan}")
+        await conn.rollback()
+    await engine.dispose()
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+import models
+from cache import TTLCache
+
+# Read-mostly tables served on the main screen
+CONTENT_MODELS = (models.FaQ, models.Videos, models.Numbers)
+_CONTENT_TABLES = {model.__tablename__ for model in CONTENT_MODELS}
+
+# Writes made through this app invalidate immediately; edits made directly in the database are
+# picked up once cached table state is this many seconds old
+CONTENT_STATS_TTL = float(os.getenv("CONTENT_STATS_TTL", "300"))
+
+_states = TTLCache(maxsize=len(CONTENT_MODELS), ttl=CONTENT_STATS_TTL)
+_listeners = {}
+
+
+class TableState:
+    def __init__(self, total: int, version: str):
+        self.total = total
+        self.version = version
+
+
+def digest(rows):
+    return hashlib.blake2b(repr(list(rows)).encode('utf-8'), digest_size=8).hexdigest()
+
+
+async def _state(db, model):
+    state = _states.get(model.__tablename__)
+    if state is None:
+        # One cheap statement, no rows fetched: the change counter that database triggers bump on
+        # every write to the table, plus the row count and highest id
+        table = model.__table__
+        version = select(models.ContentVersion.version).where(
+            models.ContentVersion.table_name == model.__tablename__).scalar_subquery()
+        row = (await db.execute(select(func.count(), func.max(table.c.id), version).select_from(table))).one()
+        state = TableState(row[0], f"{row[2] or 0}.{row[0]}.{row[1] or 0}")
+        _states.set(model.__tablename__, state)
+    return state
+
+
+async def get_total(db, model):
+    return (await _state(db, model)).total
+
+
+async def get_version(db, model):
+    return (await _state(db, model)).version
+
+
+def on_change(table: str, callback):
+    _listeners.setdefault(table, []).append(callback)
+
+
+def invalidate(table: str):
+    _states.pop(table)
+    for callback in _listeners.get(table, ()):
+        callback()
+
+
+def _changed(session):
+    return session.info.setdefault("content_changed", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table in _CONTENT_TABLES:
+            _changed(session).add(table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if not orm_execute_state.is_select and mapper is not None and mapper.local_table.name in _CONTENT_TABLES:
+        _changed(orm_execute_state.session).add(mapper.local_table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for table in session.info.pop("content_changed", ()):
+        invalidate(table)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("content_changed", None)
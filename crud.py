@@ -1,244 +1,368 @@
 import datetime
-import hashlib
-import random
-from sqlalchemy.orm import Session, defer
+import os
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import content
+import metrics
 import models
+import numerology
 import schemas
-
-
-def hashed_password(password: str):
-    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), b'germesik228', 100000, dklen=32)
-
-
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
-
-
-def create_user(db: Session, user: schemas.UserCreate):
+from cache import CacheRegion, TTLCache
+from hashing import verify_digest
+
+# Validated tokens, keyed by token string. Logout and token revocation in this process evict
+# entries immediately; other workers see revocations once the entry's TTL runs out.
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "60")),
+)
+# Seconds a login token stays valid, 0 keeps tokens until logout
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", str(30 * 24 * 3600)))
+# Seconds a confirmed forgot-password request can be used to set a new password
+REQUEST_TTL = int(os.getenv("REQUEST_TTL", "900"))
+
+# Second-level cache for content read queries, keyed by query, language and page.
+# Keys also carry the table version, so a cached page always matches the ETag it is served with.
+read_cache = CacheRegion(
+    "content",
+    maxsize=int(os.getenv("READ_CACHE_SIZE", "2048")),
+    ttl=content.CONTENT_STATS_TTL,
+)
+metrics.registry.counter_from("token_cache_hits_total", "Token lookups served from the cache", lambda: token_cache.hits)
+metrics.registry.counter_from("token_cache_misses_total", "Token lookups that went to the database", lambda: token_cache.misses)
+metrics.registry.counter_from("read_cache_hits_total", "Content queries served from the read cache", lambda: read_cache.hits)
+metrics.registry.counter_from("read_cache_misses_total", "Content queries run against the database", lambda: read_cache.misses)
+for _model in (models.FaQ, models.Videos):
+    content.on_change(_model.__tablename__, lambda table=_model.__tablename__: read_cache.invalidate(table))
+
+
+# Write functions below only flush: the handler commits once at the end of the request,
+# and tokens revoked in the transaction are evicted from token_cache once it commits.
+def _evict_tokens(db: AsyncSession, tokens):
+    db.info.setdefault("evicted_tokens", set()).update(tokens)
+
+
+@event.listens_for(Session, "after_commit")
+def _evict_committed(session):
+    for token in session.info.pop("evicted_tokens", ()):
+        token_cache.pop(token)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("evicted_tokens", None)
+
+
+@metrics.timed("db")
+async def create_user(db: AsyncSession, user: schemas.UserCreate, digest: str):
     try:
         db_user = models.User(
             name=user.name,
             email=user.email,
-            password=str(hashed_password(user.password)),
+            password=digest,
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.flush()
         return db_user
     except:
+        metrics.swallowed("crud.create_user")
         return
 
 
-def delete_user(db: Session, user: models.User):
+@metrics.timed("db")
+async def delete_user(db: AsyncSession, user: models.User):
     try:
-        db.delete(user)
-        db.commit()
+        await user_remove_tokens(db, user)
+        await db.execute(delete(models.User).where(models.User.id == user.id))
     except:
+        metrics.swallowed("crud.delete_user")
         return
 
 
 def verify_password(user: models.User, password: str):
-    return str(hashed_password(password)) == user.password
+    return verify_digest(password, user.password)
 
 
-def create_token(db: Session, user_id):
+@metrics.timed("db")
+async def create_token(db: AsyncSession, user_id):
     try:
         token = models.Token(
             user=user_id,
         )
         db.add(token)
-        db.commit()
-        db.refresh(token)
+        await db.flush()
         return token
     except:
+        metrics.swallowed("crud.create_token")
         return
 
 
-def get_token(db: Session, token: str):
-    try:
-        return db.query(models.Token).filter(models.Token.token == token).first()
-    except:
+def _token_expired(token: schemas.TokenBase):
+    if TOKEN_TTL <= 0:
+        return False
+    return token.created_on is None or token.created_on < datetime.datetime.now() - datetime.timedelta(seconds=TOKEN_TTL)
+
+
+@metrics.timed("db")
+async def get_token(db: AsyncSession, token: str):
+    cached = token_cache.get(token)
+    if not cached:
+        try:
+            db_token = await db.scalar(select(models.Token).where(models.Token.token == token))
+        except:
+            metrics.swallowed("crud.get_token")
+            return
+        if not db_token:
+            return
+        cached = schemas.TokenBase.model_validate(db_token)
+        token_cache.set(token, cached)
+    if _token_expired(cached):
+        token_cache.pop(token)
         return
+    return cached
 
 
-def remove_token(db: Session, token: models.Token):
+@metrics.timed("db")
+async def remove_token(db: AsyncSession, token: schemas.TokenBase):
     try:
-        db.delete(token)
-        db.commit()
+        await db.execute(delete(models.Token).where(models.Token.token == token.token))
     except:
+        metrics.swallowed("crud.remove_token")
         return
+    _evict_tokens(db, [token.token])
 
 
-def get_user_by_email(db: Session, email: str):
+@metrics.timed("db")
+async def get_user_by_email(db: AsyncSession, email: str):
     try:
-        return db.query(models.User).filter(models.User.email == email).first()
+        return await db.scalar(select(models.User).where(models.User.email == email))
     except:
+        metrics.swallowed("crud.get_user_by_email")
         return
 
 
-def get_user_by_id(db: Session, user_id: str):
+@metrics.timed("db")
+async def get_user_by_id(db: AsyncSession, user_id: str):
     try:
-        return db.query(models.User).filter(models.User.id == user_id).first()
+        return await db.scalar(select(models.User).where(models.User.id == str(user_id)))
     except:
+        metrics.swallowed("crud.get_user_by_id")
         return
 
 
-def user_remove_tokens(db: Session, user: models.User):
-    db.query(models.Token).filter(models.Token.user == user.id).delete()
-    db.commit()
-    db.refresh(user)
+@metrics.timed("db")
+async def user_remove_tokens(db: AsyncSession, user: models.User):
+    tokens = (await db.scalars(delete(models.Token).where(models.Token.user == user.id).returning(models.Token.token))).all()
+    _evict_tokens(db, tokens)
 
 
-def user_update_password(db: Session, user: models.User, password: str):
+@metrics.timed("db")
+async def user_update_password(db: AsyncSession, user: models.User, digest: str):
     try:
-        user.password = str(hashed_password(password))
-        db.commit()
-        db.refresh(user)
-        user_remove_tokens(db, user)
+        user.password = digest
+        await user_remove_tokens(db, user)
     except:
+        metrics.swallowed("crud.user_update_password")
         return
 
 
-def user_update_name(db: Session, user: models.User, name: str):
-    try:
-        user.name = name
-        db.commit()
-        db.refresh(user)
-    except:
-        return
+async def user_update_name(db: AsyncSession, user: models.User, name: str):
+    user.name = name
 
 
-def user_update_email(db: Session, user: models.User, email: str):
+@metrics.timed("db")
+async def user_update_email(db: AsyncSession, user: models.User, email: str):
     try:
         user.email = email
-        db.commit()
-        db.refresh(user)
-        user_remove_tokens(db, user)
+        await user_remove_tokens(db, user)
     except:
+        metrics.swallowed("crud.user_update_email")
         return
 
 
-def create_code(db: Session, user_id, step: str):
+@metrics.timed("db")
+async def create_code(db: AsyncSession, user_id, step: str, value: int):
     try:
         code = models.Code(
-            code=random.randint(1000, 9999),
+            code=value,
             user=user_id,
             step=step,
         )
         db.add(code)
-        db.commit()
-        db.refresh(code)
+        await db.flush()
         return code
     except:
+        metrics.swallowed("crud.create_code")
         return
 
 
-def update_code(db: Session, code: models.Code):
+@metrics.timed("db")
+async def update_code(db: AsyncSession, code: models.Code, value: int):
     try:
-        code.code = random.randint(1000, 9999)
+        code.code = value
         code.attempts = 0
-        db.commit()
-        db.refresh(code)
+        await db.flush()
         return code
     except:
+        metrics.swallowed("crud.update_code")
         return
 
 
-def verify_code(db: Session, codeObj: models.Code, code: str):
-    if codeObj.attempts < 3:
-        codeObj.attempts += 1
-        db.commit()
-        db.refresh(codeObj)
-    else:
-        remove_code(db, codeObj)
-    result = code == str(codeObj.code)
-    if result:
-        remove_code(db, codeObj)
-    return result
+@metrics.timed("db")
+async def claim_code_attempt(db: AsyncSession, user_id, step: str, max_attempts: int):
+    # Check-and-increment in one statement; update_on is kept so attempts don't extend the code's life
+    result = await db.execute(update(models.Code).where(
+        models.Code.user == user_id,
+        models.Code.step == step,
+        models.Code.attempts < max_attempts,
+    ).values(
+        attempts=models.Code.attempts + 1,
+        update_on=models.Code.update_on,
+    ).returning(models.Code.code, models.Code.attempts, models.Code.update_on))
+    return result.first()
 
 
-def get_code(db: Session, user_id, step: str):
-    return db.query(models.Code).filter(models.Code.user == user_id and models.Code.step == step).order_by(
-        models.Code.id.desc()).first()
+@metrics.timed("db")
+async def get_code(db: AsyncSession, user_id, step: str):
+    return await db.scalar(select(models.Code).where(models.Code.user == user_id, models.Code.step == step).order_by(
+        models.Code.id.desc()).limit(1))
 
 
-def remove_code(db: Session, code: models.Code):
+@metrics.timed("db")
+async def remove_codes(db: AsyncSession, user_id, step: str):
     try:
-        db.delete(code)
-        db.commit()
+        await db.execute(delete(models.Code).where(models.Code.user == user_id, models.Code.step == step))
     except:
+        metrics.swallowed("crud.remove_codes")
         return
 
 
-def create_request(db: Session, step: str, user_id):
+@metrics.timed("db")
+async def create_request(db: AsyncSession, step: str, user_id):
     try:
         request = models.Request(
             user=user_id,
             step=step,
         )
         db.add(request)
-        db.commit()
-        db.refresh(request)
+        await db.flush()
         return request
     except:
+        metrics.swallowed("crud.create_request")
         return
 
 
-def get_request(db: Session, request_id, user_id):
-    return db.query(models.Request).filter(models.Request.id == request_id and models.Request.user == user_id).order_by(
-        models.Request.id.desc()).first()
+@metrics.timed("db")
+async def get_request(db: AsyncSession, request_id, user_id):
+    return await db.scalar(select(models.Request).where(
+        models.Request.id == request_id,
+        models.Request.user == user_id,
+        models.Request.created_on >= datetime.datetime.now() - datetime.timedelta(seconds=REQUEST_TTL),
+    ))
 
 
-def remove_request(db: Session, request: models.Request):
+@metrics.timed("db")
+async def remove_request(db: AsyncSession, request: models.Request):
     try:
-        db.delete(request)
-        db.commit()
+        await db.execute(delete(models.Request).where(models.Request.id == request.id))
     except:
+        metrics.swallowed("crud.remove_request")
         return
 
 
-def get_videos(db: Session, offset: int, limit: int, lang: str = "en"):
+def expired_batch(model, column, cutoff: datetime.datetime, batch: int):
+    # Rows with no timestamp predate the column and are treated as expired
+    key = model.__table__.primary_key.columns.values()[0]
+    expired = select(key).where((column < cutoff) | column.is_(None)).limit(batch)
+    return delete(model).where(key.in_(expired.scalar_subquery()))
+
+
+@metrics.timed("db")
+async def remove_expired(db: AsyncSession, model, column, cutoff: datetime.datetime, batch: int):
+    result = await db.execute(expired_batch(model, column, cutoff, batch))
+    return result.rowcount
+
+
+def _page(query, column, offset, limit, after_id):
+    # Keyset mode seeks past the last seen id, offset mode is kept for old clients
+    if after_id is not None:
+        query = query.where(column > after_id)
+    elif offset:
+        query = query.offset(offset)
+    return query.order_by(column).limit(limit)
+
+
+_UNCACHED = object()
+
+
+async def _cached(db: AsyncSession, model, key, query, first=False):
+    table = model.__tablename__
+    key = (await content.get_version(db, model), *key)
+    rows = read_cache.get(table, key, _UNCACHED)
+    if rows is _UNCACHED:
+        result = await db.execute(query)
+        rows = result.first() if first else tuple(result.all())
+        read_cache.set(table, key, rows)
+    return rows
+
+
+@metrics.timed("db")
+async def get_videos(db: AsyncSession, offset: int, limit: int, lang: str = "en", after_id: int = None):
+    total = await content.get_total(db, models.Videos)
     if lang == "en":
-        return db.query(models.Videos.id).count(), db.query(
+        query = select(
             models.Videos.id,
             models.Videos.preview,
             models.Videos.title_en.label('title'),
             models.Videos.description_en.label('description'),
             models.Videos.link
-        ).offset(offset).limit(limit)
-    return db.query(models.Videos.id).count(), db.query(
-        models.Videos.id,
-        models.Videos.preview,
-        models.Videos.title_it.label('title'),
-        models.Videos.description_it.label('description'),
-        models.Videos.link
-    ).offset(offset).limit(limit)
+        )
+    else:
+        query = select(
+            models.Videos.id,
+            models.Videos.preview,
+            models.Videos.title_it.label('title'),
+            models.Videos.description_it.label('description'),
+            models.Videos.link
+        )
+    key = ("videos", lang, offset, limit, after_id)
+    return total, await _cached(db, models.Videos, key, _page(query, models.Videos.id, offset, limit, after_id))
 
 
-def get_questions(db: Session, offset: int, limit: int, lang: str = "en"):
+@metrics.timed("db")
+async def get_questions(db: AsyncSession, offset: int, limit: int, lang: str = "en", after_id: int = None):
+    total = await content.get_total(db, models.FaQ)
     if lang == "en":
-        return db.query(models.FaQ).count(), db.query(
+        query = select(
             models.FaQ.id,
             models.FaQ.question_en.label('question')
-        ).offset(offset).limit(limit)
-    return db.query(models.FaQ).count(), db.query(
-        models.FaQ.id,
-        models.FaQ.question_it.label('question')
-    ).offset(offset).limit(limit)
+        )
+    else:
+        query = select(
+            models.FaQ.id,
+            models.FaQ.question_it.label('question')
+        )
+    key = ("questions", lang, offset, limit, after_id)
+    return total, await _cached(db, models.FaQ, key, _page(query, models.FaQ.id, offset, limit, after_id))
 
 
-def get_question_by_id(db: Session, faq_id: int, lang: str = "en"):
+@metrics.timed("db")
+async def get_question_by_id(db: AsyncSession, faq_id: int, lang: str = "en"):
     if lang == "en":
-        return db.query(
+        query = select(
             models.FaQ.id,
             models.FaQ.question_en.label('question'),
             models.FaQ.answer_en.label('answer'),
-        ).filter(models.FaQ.id == faq_id).first()
-    return db.query(
-        models.FaQ.id,
-        models.FaQ.question_it.label('question'),
-        models.FaQ.answer_it.label('answer'),
-    ).filter(models.FaQ.id == faq_id).first()
+        )
+    else:
+        query = select(
+            models.FaQ.id,
+            models.FaQ.question_it.label('question'),
+            models.FaQ.answer_it.label('answer'),
+        )
+    key = ("question", lang, faq_id)
+    return await _cached(db, models.FaQ, key, query.where(models.FaQ.id == faq_id), first=True)
 
 
 def _sum_of_digits(x: int):
@@ -248,16 +372,8 @@ def _sum_of_digits(x: int):
     return result
 
 
-def get_number(db: Session, date: datetime.datetime, lang: str = "en"):
-    number = _sum_of_digits(date.day)
-    if lang == "en":
-        return db.query(
-            models.Numbers.id,
-            models.Numbers.number,
-            models.Numbers.description_en.label('description'),
-        ).filter(models.Numbers.number == number).first()
-    return db.query(
-        models.Numbers.id,
-        models.Numbers.number,
-        models.Numbers.description_it.label('description'),
-    ).filter(models.Numbers.number == number).first()
+def get_number(date: datetime.datetime, lang: str = "en"):
+    number = numerology.date_index.day_number(date)
+    if number is None:
+        number = _sum_of_digits(date.day)
+    return numerology.lookup(number, lang)
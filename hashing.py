@@ -0,0 +1,63 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 0 workers hashes inline on the calling thread
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed to wait for a free worker before new ones are rejected
+HASH_POOL_QUEUE = int(os.getenv("HASH_POOL_QUEUE", "64"))
+
+
+def hashed_password(password: str):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), b'germesik228', 100000, dklen=32)
+
+
+def password_digest(password: str):
+    return str(hashed_password(password))
+
+
+def verify_digest(password: str, digest: str):
+    return digest is not None and hmac.compare_digest(password_digest(password), digest)
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    """Runs PBKDF2 hashing in worker processes, off the event loop."""
+
+    def __init__(self, workers=HASH_POOL_WORKERS, queue=HASH_POOL_QUEUE):
+        self.workers = workers
+        self.queue = queue
+        self.pending = 0
+        self._executor = None
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if self.pending >= self.workers + self.queue:
+            raise PoolBusy()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        return await self._run(password_digest, password)
+
+    async def verify(self, password: str, digest: str):
+        return await self._run(verify_digest, password, digest)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+hash_pool = HashPool()
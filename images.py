@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+import metrics
+
+# Largest accepted avatar upload, in bytes
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+# Largest accepted avatar in pixels; a small compressed file can decode to gigabytes
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", str(40_000_000)))
+# Uploads are sent to MinIO one part at a time; S3 needs parts of at least 5 MiB
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", str(5 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Longest side in pixels of each stored avatar variant
+AVATAR_SIZES = {
+    "thumb": int(os.getenv("AVATAR_THUMB_PX", "96")),
+    "medium": int(os.getenv("AVATAR_MEDIUM_PX", "320")),
+}
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+RESIZE_WORKERS = int(os.getenv("RESIZE_WORKERS", "2"))
+
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+SNIFF_BYTES = max(len(magic) for magic, _ in SIGNATURES)
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def sniff(head: bytes):
+    """Content type from the file's magic bytes, or None for anything but PNG and JPEG."""
+    for magic, content_type in SIGNATURES:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+
+class LimitedReader:
+    """File wrapper that raises ImageTooLarge as soon as more than `limit` bytes were read."""
+
+    def __init__(self, file, limit=AVATAR_MAX_BYTES):
+        self.file = file
+        self.limit = limit
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        # Never read past the limit by more than one byte, whatever size is asked for
+        allowed = self.limit - self.read_bytes + 1
+        chunk = self.file.read(allowed if size is None or size < 0 else min(size, allowed))
+        self.read_bytes += len(chunk)
+        if self.read_bytes > self.limit:
+            raise ImageTooLarge()
+        return chunk
+
+
+def _check_pixels(image):
+    width, height = image.size
+    if width * height > AVATAR_MAX_PIXELS:
+        raise ImageTooLarge()
+
+
+def check_pixels(file):
+    """Raises ImageTooLarge when the image header declares more than AVATAR_MAX_PIXELS; nothing is decoded."""
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            _check_pixels(image)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge()
+    finally:
+        file.seek(position)
+
+
+def variant_name(file_name, size):
+    return f"{os.path.splitext(file_name)[0]}_{size}.webp"
+
+
+def variants(data: bytes):
+    """WebP encodings of the image for every size in AVATAR_SIZES."""
+    largest = max(AVATAR_SIZES.values())
+    with Image.open(BytesIO(data)) as image:
+        _check_pixels(image)
+        # JPEGs are decoded straight at a reduced scale when they are much larger than needed
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA") or "transparency" in image.info else "RGB")
+    result = {}
+    # Largest first, so every smaller size is downscaled from the previous one
+    for size, px in sorted(AVATAR_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((px, px), Image.LANCZOS)
+        out = BytesIO()
+        image.save(out, "WEBP", quality=WEBP_QUALITY)
+        result[size] = out.getvalue()
+    return result
+
+
+class ResizePool:
+    """Builds avatar variants on worker threads after an upload; Pillow releases the GIL while it resizes."""
+
+    def __init__(self, workers=RESIZE_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="resize")
+
+    def submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(metrics.report_failure("images.resize"))
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+resizer = ResizePool()
@@ -0,0 +1,87 @@
+import base64
+from functools import lru_cache
+from email.header import Header
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from os import path
+
+TEMPLATE_PATH = path.join(path.dirname(path.abspath(__file__)), "templates", "verification.html")
+
+# (theme, text) pairs sent by the API, rendered at startup
+MESSAGES = [
+    ("Регистрация", "Спасибо за регистрацию"),
+    ("Удаление профиля", "Удаление профиля"),
+    ("Сброс пароля", "Сброс пароля"),
+    ("Изменение почты", "Изменение почты"),
+]
+
+# MIME wraps base64 bodies at 76 characters, i.e. 57 input bytes per line
+_BASE64_LINE = 57
+_TO_MARK = "\x00to\x00"
+_BODY_MARK = "\x00body\x00"
+
+
+class EmailTemplate:
+    def __init__(self, source):
+        self.before_text, rest = source.split("{{ text }}")
+        self.before_code, self.after_code = rest.split("{{ code }}")
+
+    def html(self, text, code):
+        return self.before_text + text + self.before_code + code + self.after_code
+
+
+class Skeleton:
+    """
+    A fully serialized message for one theme/text pair with holes for the recipients and the code.
+
+    Everything up to the code is base64 encoded once. The HTML in front of the code is padded with
+    spaces to a whole number of base64 lines, so the code and the short HTML tail can be encoded on
+    their own at send time and appended.
+    """
+
+    def __init__(self, template, theme, text, sender):
+        prefix = (template.before_text + text + template.before_code).encode('utf-8')
+        # Pad between the last two tags so no whitespace ends up next to the code
+        split = prefix.rindex(b"<")
+        prefix = prefix[:split] + b" " * (-len(prefix) % _BASE64_LINE) + prefix[split:]
+        self.tail = template.after_code.encode('utf-8')
+
+        msg = MIMEMultipart()
+        msg['From'] = sender
+        msg['To'] = _TO_MARK
+        msg['Subject'] = theme
+        part = MIMEText("", 'html', 'utf-8')
+        part.set_payload(_BODY_MARK)
+        msg.attach(part)
+
+        self.head, rest = msg.as_string().split(_TO_MARK)
+        before_body, self.end = rest.split(_BODY_MARK)
+        self.before_code = before_body + base64.encodebytes(prefix).decode('ascii')
+
+    def render(self, addressees, code):
+        body = base64.encodebytes(code.encode('utf-8') + self.tail).decode('ascii')
+        return "".join((self.head, _format_to(addressees), self.before_code, body, self.end))
+
+
+def _format_to(addressees):
+    to = ', '.join(addressees)
+    if to.isascii():
+        return to
+    return Header(to, 'utf-8').encode()
+
+
+template = EmailTemplate(open(TEMPLATE_PATH, encoding='utf-8').read())
+
+
+@lru_cache(maxsize=32)
+def skeleton(theme, text, sender):
+    return Skeleton(template, theme, text, sender)
+
+
+def preload(sender):
+    for theme, text in MESSAGES:
+        skeleton(theme, text, sender)
+
+
+def render(addressees, theme, text, code, sender):
+    return skeleton(theme, text, sender).render(addressees, code)
@@ -1,30 +1,79 @@
-import datetime
-from io import BytesIO
-from typing import Annotated
+import hmac
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Annotated, Optional
 from fastapi import Depends, FastAPI, HTTPException, Form, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 import crud
-import models
+import images
+import metrics
+import migrate
+import numerology
+import otp
+import profiler
 from router import api_router
 import schemas
-from database import SessionLocal, engine
+from database import engine, get_db, pool_stats
 from fastapi.security.http import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import Annotated
-from smtp import send_email
+from smtp import mailer
+from hashing import hash_pool, PoolBusy
+from reaper import reaper
+from startup import StartupChecks
 from minioClient import MinioClient
 import re
 from starlette.requests import Request
 
+# Background workers report through logging; LOG_LEVEL=DEBUG shows everything
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+# Bearer token for /metrics and /stats/; while unset both answer 404
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 minio = MinioClient()
+checks = StartupChecks()
+
+
+async def prepare_database():
+    async with engine.begin() as conn:
+        await conn.run_sync(migrate.upgrade)
+    await numerology.reload()
+
+
+checks.add("database", prepare_database)
+# Avatars fall back to no URL while MinIO is away, so the worker can serve without it
+checks.add("object_store", minio.prepare, required=False)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    numerology.open_index()
+    await checks.run()
+    reaper.start()
+    numerology.start_watching()
+    try:
+        yield
+    finally:
+        await checks.stop()
+        await reaper.stop()
+        await numerology.stop_watching()
+        mailer.close()
+        images.resizer.close()
+        hash_pool.shutdown()
+        await engine.dispose()
 
-models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
+app.add_middleware(profiler.ProfilerMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -34,13 +83,43 @@ app.add_middleware(
 )
 
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+@app.exception_handler(PoolBusy)
+async def pool_busy_handler(request: Request, exc: PoolBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server is busy, try again later"})
+
+
+CODE_ERRORS = {
+    otp.MISSING: (400, "Code not found"),
+    otp.EXPIRED: (410, "Code is outdated"),
+    otp.INCORRECT: (400, "Incorrect code"),
+}
+
+
+async def issue_code(db: AsyncSession, user_id, step: str):
     try:
-        yield db
-    finally:
-        db.close()
+        code = await otp.store.issue(db, user_id, step)
+    except otp.Cooldown as e:
+        raise HTTPException(status_code=429, detail=f"Please wait [{e.seconds}] seconds")
+    if not code:
+        raise HTTPException(status_code=400, detail="Create code error")
+    return code
+
+
+async def send_code(db: AsyncSession, user_id, step: str, address: str, **mail):
+    """Issues a code, commits it and mails it; a full mail queue fails the request before anything is stored."""
+    with mailer.reserve() as send:
+        code = await issue_code(db, user_id, step)
+        await db.commit()
+        send([address], code=code, **mail)
+
+
+async def confirm_code(db: AsyncSession, user_id, step: str, code: str):
+    result = await otp.store.verify(db, user_id, step, code)
+    if result != otp.OK:
+        # A failed attempt still counts when codes live in the database
+        await db.commit()
+        status_code, detail = CODE_ERRORS[result]
+        raise HTTPException(status_code=status_code, detail=detail)
 
 
 def password_check(passwd):
@@ -68,43 +147,30 @@ def password_check(passwd):
 
 
 get_bearer_token = HTTPBearer()
+get_service_token = HTTPBearer(auto_error=False)
 
 
 @app.post("/signup/", status_code=201, tags=["signup"])
 async def signup(
         user: schemas.UserCreate,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     if not re.fullmatch(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b', user.email):
         raise HTTPException(status_code=400, detail="Invalid email")
 
     password_check(user.password)
 
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_user_by_email(db, email=user.email)
     if db_user and db_user.status:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     if not db_user:
-        db_user = crud.create_user(db=db, user=user)
+        digest = await hash_pool.hash(user.password)
+        db_user = await crud.create_user(db=db, user=user, digest=digest)
         if not db_user:
             raise HTTPException(status_code=500, detail="Create user error")
 
-    codeObj = crud.get_code(db=db, user_id=db_user.id, step="signup")
-    if codeObj:
-        t = 60 - int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp())
-        if t >= 0:
-            raise HTTPException(status_code=429, detail=f"Please wait [{t}] seconds")
-        else:
-            crud.update_code(db=db, code=codeObj)
-    else:
-        codeObj = crud.create_code(db=db, user_id=db_user.id, step="signup")
-        if not codeObj:
-            raise HTTPException(status_code=400, detail="Create code error")
-
-    try:
-        send_email([db_user.email], code=str(codeObj.code))
-    except:
-        pass
+    await send_code(db, db_user.id, "signup", db_user.email)
 
     result = schemas.UserBase(
         id=db_user.id,
@@ -120,38 +186,24 @@ async def signup(
 @app.post("/signup/confirm", status_code=201, tags=["signup"])
 async def check_code(
         o: schemas.CheckCode,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     email = o.email
     code = o.code
 
-    user = crud.get_user_by_email(db=db, email=email)
+    user = await crud.get_user_by_email(db=db, email=email)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=user.id, step="signup")
-    if not codeObj:
-        raise HTTPException(status_code=400, detail="Code not found")
-
-    if int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp()) > 300:
-        crud.remove_code(db, codeObj)
-        raise HTTPException(status_code=410, detail="Code is outdated")
-
-    verified = crud.verify_code(db=db, codeObj=codeObj, code=code)
-    if not verified:
-        raise HTTPException(status_code=400, detail="Incorrect code")
+    await confirm_code(db, user.id, "signup", code)
 
     user.status = True
-    db.commit()
-    db.refresh(user)
-
-    token = crud.create_token(db=db, user_id=user.id)
+    token = await crud.create_token(db=db, user_id=user.id)
     if not token:
         raise HTTPException(status_code=500, detail="Create token error")
+    await db.commit()
 
-    src = minio.get_url("avatars", f"{token.user}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = minio.avatar_url(token.user)
 
     result = schemas.UserBase(
         id=user.id,
@@ -166,23 +218,23 @@ async def check_code(
 @app.post("/login/", status_code=201, tags=["signup"])
 async def login(
         user: schemas.UserLogin,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
+        size: Optional[schemas.AvatarSize] = None,
 ):
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_user_by_email(db, email=user.email)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    login = crud.verify_password(user=db_user, password=user.password)
+    login = await hash_pool.verify(user.password, db_user.password)
     if not login:
         raise HTTPException(status_code=400, detail="Incorrect password")
 
-    token = crud.create_token(db, db_user.id)
+    token = await crud.create_token(db, db_user.id)
     if not token:
         raise HTTPException(status_code=500, detail="Create token error")
+    await db.commit()
 
-    src = minio.get_url("avatars", f"{token.user}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = minio.avatar_url(token.user, size)
 
     result = schemas.UserBase(
         id=db_user.id,
@@ -194,16 +246,17 @@ async def login(
     return result
 
 
+@metrics.timed("auth")
 async def check_token(
         auth: Annotated[HTTPAuthorizationCredentials, Depends(get_bearer_token)],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)]
 ):
     if not auth or not auth.credentials:
         raise HTTPException(
             status_code=401,
             detail="Unauthorized",
         )
-    token = crud.get_token(db, auth.credentials)
+    token = await crud.get_token(db, auth.credentials)
     if not token:
         raise HTTPException(
             status_code=401,
@@ -214,91 +267,88 @@ async def check_token(
 
 @app.post("/logout/")
 async def logout(
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)],
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
-    crud.remove_token(db, token)
+    await crud.remove_token(db, token)
+    await db.commit()
     return {"status": "ok"}
 
 
+async def upload_avatar(image: UploadFile, user_id):
+    # The declared content type is not trusted: the type comes from the file's first bytes
+    if image.size is not None and image.size > images.AVATAR_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large")
+    content_type = images.sniff(await image.read(images.SNIFF_BYTES))
+    if content_type is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Incorrect format",
+        )
+    await image.seek(0)
+
+    try:
+        await run_in_threadpool(images.check_pixels, image.file)
+        await run_in_threadpool(
+            minio.save_image_stream, "avatars", f"{user_id}.png", images.LimitedReader(image.file), content_type
+        )
+    except images.ImageTooLarge:
+        raise HTTPException(status_code=413, detail="Image is too large")
+    except images.UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Incorrect format")
+    images.resizer.submit(minio.save_variants, "avatars", f"{user_id}.png")
+    return minio.avatar_url(user_id)
+
+
 @app.post("/set-avatar/{user_id}", status_code=200, tags=["signup"])
 async def set_avatar(
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         user_id: str,
         image: UploadFile
 ):
-    db_user = crud.get_user_by_id(db, user_id=user_id)
+    db_user = await crud.get_user_by_id(db, user_id=user_id)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
     if db_user.status:
         raise HTTPException(status_code=400, detail="User already activated")
 
-    content_type = image.headers.get('content-type')
-    if content_type not in ['image/jpeg', 'image/png']:
-        raise HTTPException(
-            status_code=400,
-            detail="Incorrect format",
-        )
-    data = BytesIO()
-    data.write(await image.read())
-    data.seek(0)
-
-    minio.save_image_bytes("avatars", f"{db_user.id}.png", data, image.size, content_type)
-    src = minio.get_url("avatars", f"{db_user.id}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = await upload_avatar(image, db_user.id)
 
     return {"avatar": src}
 
 
 @app.post("/change-avatar/", status_code=200, tags=["user_info"])
 async def change_avatar(
-        token: Annotated[models.Token, Depends(check_token)],
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
         image: UploadFile
 ):
-    content_type = image.headers.get('content-type')
-    if content_type not in ['image/jpeg', 'image/png']:
-        raise HTTPException(
-            status_code=400,
-            detail="Incorrect format",
-        )
-
-    data = BytesIO()
-    data.write(await image.read())
-    data.seek(0)
-
-    minio.save_image_bytes("avatars", f"{token.user}.png", data, image.size, content_type)
-    src = minio.get_url("avatars", f"{token.user}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = await upload_avatar(image, token.user)
 
     return {"avatar": src}
 
 
 @app.get("/get-avatar/", status_code=200, tags=["user_info"])
 async def get_avatar(
-        token: Annotated[models.Token, Depends(check_token)]
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        size: Optional[schemas.AvatarSize] = None,
 ):
-    src = minio.get_url("avatars", f"{token.user}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = minio.avatar_url(token.user, size)
 
     return {"avatar": src}
 
 
 @app.get("/get-me/", status_code=200, response_model=schemas.UserResult, tags=["user_info"])
 async def get_me(
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)]
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)],
+        size: Optional[schemas.AvatarSize] = None,
 ):
-    user = crud.get_user_by_id(db=db, user_id=token.user)
+    user = await crud.get_user_by_id(db=db, user_id=token.user)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    src = minio.get_url("avatars", f"{token.user}.png")
-    if not src:
-        src = minio.get_url("avatars", f"user.png")
+    src = minio.avatar_url(token.user, size)
 
     result = schemas.UserResult(
         id=user.id,
@@ -312,29 +362,14 @@ async def get_me(
 
 @app.post("/delete-me/request", status_code=200, tags=["user"])
 async def delete_me_request(
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)]
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)]
 ):
-    user = crud.get_user_by_id(db=db, user_id=token.user)
+    user = await crud.get_user_by_id(db=db, user_id=token.user)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=user.id, step="deleteme")
-    if codeObj:
-        t = 60 - int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp())
-        if t >= 0:
-            raise HTTPException(status_code=429, detail=f"Please wait [{t}] seconds")
-        else:
-            crud.update_code(db=db, code=codeObj)
-    else:
-        codeObj = crud.create_code(db=db, user_id=user.id, step="deleteme")
-        if not codeObj:
-            raise HTTPException(status_code=400, detail="Create code error")
-
-    try:
-        send_email([user.email], code=str(codeObj.code), theme="Удаление профиля", text="Удаление профиля")
-    except Exception as e:
-        print(e)
+    await send_code(db, user.id, "deleteme", user.email, theme="Удаление профиля", text="Удаление профиля")
 
     return {
         "status": "ok",
@@ -345,27 +380,18 @@ async def delete_me_request(
 @app.post("/delete-me/confirm", status_code=200, tags=["user"])
 async def delete_me_confirm(
         o: schemas.ConfirmCode,
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)]
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)]
 ):
     code = o.code
-    user = crud.get_user_by_id(db=db, user_id=token.user)
+    user = await crud.get_user_by_id(db=db, user_id=token.user)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=user.id, step="deleteme")
-    if not codeObj:
-        raise HTTPException(status_code=400, detail="Code not found")
-
-    if int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp()) > 300:
-        crud.remove_code(db, codeObj)
-        raise HTTPException(status_code=410, detail="Code is outdated")
-
-    verified = crud.verify_code(db=db, codeObj=codeObj, code=code)
-    if not verified:
-        raise HTTPException(status_code=400, detail="Incorrect code")
+    await confirm_code(db, user.id, "deleteme", code)
 
-    crud.delete_user(db=db, user=user)
+    await crud.delete_user(db=db, user=user)
+    await db.commit()
 
     return {
         "status": "ok",
@@ -375,29 +401,14 @@ async def delete_me_confirm(
 @app.post("/forgot-password/request", status_code=200, tags=["forgot_password"])
 async def forgot_password_request(
         o: schemas.ForgotPasswordRequest,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     email = o.email
-    db_user = crud.get_user_by_email(db=db, email=email)
+    db_user = await crud.get_user_by_email(db=db, email=email)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=db_user.id, step="forgot")
-    if codeObj:
-        t = 60 - int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp())
-        if t >= 0:
-            raise HTTPException(status_code=429, detail=f"Please wait [{t}] seconds")
-        else:
-            crud.update_code(db=db, code=codeObj)
-    else:
-        codeObj = crud.create_code(db=db, user_id=db_user.id, step="forgot")
-        if not codeObj:
-            raise HTTPException(status_code=400, detail="Create code error")
-
-    try:
-        send_email([db_user.email], code=str(codeObj.code), theme="Сброс пароля", text="Сброс пароля")
-    except Exception as e:
-        print(e)
+    await send_code(db, db_user.id, "forgot", db_user.email, theme="Сброс пароля", text="Сброс пароля")
 
     return {
         "status": "ok",
@@ -408,30 +419,21 @@ async def forgot_password_request(
 @app.post("/forgot-password/confirm", status_code=200, tags=["forgot_password"])
 async def forgot_password_confirm(
         o: schemas.ForgotPasswordCheckCode,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     code = o.code
     email = o.email
 
-    db_user = crud.get_user_by_email(db=db, email=email)
+    db_user = await crud.get_user_by_email(db=db, email=email)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=db_user.id, step="forgot")
-    if not codeObj:
-        raise HTTPException(status_code=400, detail="Code not found")
-
-    if int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp()) > 300:
-        crud.remove_code(db, codeObj)
-        raise HTTPException(status_code=410, detail="Code is outdated")
-
-    verified = crud.verify_code(db=db, codeObj=codeObj, code=code)
-    if not verified:
-        raise HTTPException(status_code=400, detail="Incorrect code")
+    await confirm_code(db, db_user.id, "forgot", code)
 
-    request = crud.create_request(db=db, step="forgot", user_id=db_user.id)
+    request = await crud.create_request(db=db, step="forgot", user_id=db_user.id)
     if not request:
         raise HTTPException(status_code=400, detail="Create request error")
+    await db.commit()
 
     request_id = request.id
 
@@ -444,22 +446,24 @@ async def forgot_password_confirm(
 @app.post("/forgot-password/set", status_code=200, tags=["forgot_password"])
 async def forgot_password_set(
         o: schemas.ForgotPasswordSet,
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     password = o.password
     request_id = o.request_id
     email = o.email
 
-    db_user = crud.get_user_by_email(db=db, email=email)
+    db_user = await crud.get_user_by_email(db=db, email=email)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    request = crud.get_request(db=db, request_id=request_id, user_id=db_user.id)
+    request = await crud.get_request(db=db, request_id=request_id, user_id=db_user.id)
     if not request:
         raise HTTPException(status_code=400, detail="Request not found")
-    crud.remove_request(db=db, request=request)
+    await crud.remove_request(db=db, request=request)
 
-    crud.user_update_password(db=db, user=db_user, password=password)
+    digest = await hash_pool.hash(password)
+    await crud.user_update_password(db=db, user=db_user, digest=digest)
+    await db.commit()
 
     return {
         "status": "ok",
@@ -470,41 +474,27 @@ async def forgot_password_set(
 @app.post("/change-info/request", status_code=200, tags=["change_info"])
 async def change_info_request(
         o: schemas.ChangeInfo,
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)],
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     name = o.name.strip()
     email = o.email.strip()
-    db_user = crud.get_user_by_id(db=db, user_id=token.user)
+    db_user = await crud.get_user_by_id(db=db, user_id=token.user)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
 
     if email == db_user.email:
-        crud.user_update_name(db=db, user=db_user, name=name)
+        await crud.user_update_name(db=db, user=db_user, name=name)
+        await db.commit()
         return {
             "status": "ok",
             "command": "get-me",
         }
 
-    if crud.get_user_by_email(db=db, email=email):
+    if await crud.get_user_by_email(db=db, email=email):
         raise HTTPException(status_code=400, detail="Email already in use")
 
-    codeObj = crud.get_code(db=db, user_id=db_user.id, step="changeemail")
-    if codeObj:
-        t = 60 - int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp())
-        if t >= 0:
-            raise HTTPException(status_code=429, detail=f"Please wait [{t}] seconds")
-        else:
-            crud.update_code(db=db, code=codeObj)
-    else:
-        codeObj = crud.create_code(db=db, user_id=db_user.id, step="changeemail")
-        if not codeObj:
-            raise HTTPException(status_code=400, detail="Create code error")
-
-    try:
-        send_email([email], code=str(codeObj.code), theme="Изменение почты", text="Изменение почты")
-    except Exception as e:
-        print(e)
+    await send_code(db, db_user.id, "changeemail", email, theme="Изменение почты", text="Изменение почты")
 
     return {
         "status": "ok",
@@ -515,29 +505,20 @@ async def change_info_request(
 @app.post("/change-info/confirm", status_code=200, tags=["change_info"])
 async def change_info_confirm(
         o: schemas.ChangeInfoConfirm,
-        token: Annotated[models.Token, Depends(check_token)],
-        db: Annotated[Session, Depends(get_db)],
+        token: Annotated[schemas.TokenBase, Depends(check_token)],
+        db: Annotated[AsyncSession, Depends(get_db)],
 ):
     code = o.code
     email = o.email.strip()
 
-    user = crud.get_user_by_id(db=db, user_id=token.user)
+    user = await crud.get_user_by_id(db=db, user_id=token.user)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    codeObj = crud.get_code(db=db, user_id=user.id, step="changeemail")
-    if not codeObj:
-        raise HTTPException(status_code=400, detail="Code not found")
-
-    if int(datetime.datetime.now().timestamp() - codeObj.update_on.timestamp()) > 300:
-        crud.remove_code(db, codeObj)
-        raise HTTPException(status_code=410, detail="Code is outdated")
+    await confirm_code(db, user.id, "changeemail", code)
 
-    verified = crud.verify_code(db=db, codeObj=codeObj, code=code)
-    if not verified:
-        raise HTTPException(status_code=400, detail="Incorrect code")
-
-    crud.user_update_email(db=db, user=user, email=email)
+    await crud.user_update_email(db=db, user=user, email=email)
+    await db.commit()
 
     return {
         "status": "ok",
@@ -545,4 +526,38 @@ async def change_info_confirm(
     }
 
 
+async def check_service_token(auth: Annotated[Optional[HTTPAuthorizationCredentials], Depends(get_service_token)]):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not auth or not hmac.compare_digest(auth.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.get("/stats/", status_code=200, tags=["service"], dependencies=[Depends(check_service_token)])
+async def stats():
+    return {
+        "db_pool": pool_stats.snapshot(engine.sync_engine.pool),
+        "token_cache": crud.token_cache.stats(),
+        "read_cache": crud.read_cache.stats(),
+        "reaper": reaper.stats(),
+    }
+
+
+@app.get("/live", status_code=200, tags=["service"])
+async def live():
+    return {"status": "ok"}
+
+
+@app.get("/ready", status_code=200, tags=["service"])
+async def ready():
+    return JSONResponse(status_code=200 if checks.ready else 503,
+                        content={"ready": checks.ready, "checks": checks.status})
+
+
+@app.get("/metrics", status_code=200, response_class=PlainTextResponse, tags=["service"],
+         dependencies=[Depends(check_service_token)])
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(api_router, dependencies=[Depends(check_token)])
@@ -0,0 +1,222 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative, buckets = 0, {}
+        for le, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            buckets[str(le)] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Family:
+    """A named metric with one Counter or Histogram per combination of label values."""
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = Histogram(self.buckets) if self.kind == "histogram" else Counter()
+                    self.children[values] = child
+        return child
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in list(self.children.items()):
+            if self.kind == "histogram":
+                snapshot = child.snapshot()
+                for le, count in snapshot["buckets"].items():
+                    yield f"{self.name}_bucket{_labels(self.labelnames, values, [('le', le)])} {count}"
+                yield f"{self.name}_sum{_labels(self.labelnames, values)} {snapshot['sum']}"
+                yield f"{self.name}_count{_labels(self.labelnames, values)} {snapshot['count']}"
+            else:
+                yield f"{self.name}{_labels(self.labelnames, values)} {child.value}"
+
+
+class Callback:
+    """A value read from `fn` when metrics are collected, for numbers kept elsewhere."""
+
+    def __init__(self, name, help, kind, fn):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {self.fn()}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Family(name, help, "counter", labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Family(name, help, "histogram", labelnames, buckets))
+
+    def gauge(self, name, help, fn):
+        return self._add(Callback(name, help, "gauge", fn))
+
+    def counter_from(self, name, help, fn):
+        return self._add(Callback(name, help, "counter", fn))
+
+    def register(self, name, help, metric):
+        """Exposes an existing unlabelled Counter or Histogram."""
+        family = self._add(Family(name, help, "histogram" if isinstance(metric, Histogram) else "counter"))
+        family.children[()] = metric
+        return family
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP responses by route and status", ("method", "route", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time to a complete HTTP response", ("method", "route"))
+dependency_latency = registry.histogram(
+    "dependency_duration_seconds", "Time spent in calls to the database, MinIO and SMTP", ("dependency", "operation"))
+swallowed_exceptions = registry.counter(
+    "swallowed_exceptions_total", "Exceptions caught and not re-raised", ("where",))
+
+
+def swallowed(where):
+    swallowed_exceptions.labels(where).inc()
+
+
+def report_failure(where):
+    """Done callback for background futures: counts an exception under `where` and logs its traceback."""
+    logger = logging.getLogger(where.split(".")[0])
+
+    def callback(future):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            swallowed(where)
+            logger.error("%s failed", where, exc_info=e)
+    return callback
+
+
+@contextmanager
+def timer(dependency, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        dependency_latency.labels(dependency, operation).observe(time.perf_counter() - start)
+
+
+def timed(dependency, operation=None):
+    """Decorator recording the duration of every call, sync or async, under `dependency`."""
+
+    def decorate(fn):
+        name = operation or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with timer(dependency, name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with timer(dependency, name):
+                    return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and status per route template, not per raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_latency.labels(scope["method"], path).observe(time.perf_counter() - start)
+            http_requests.labels(scope["method"], path, str(status)).inc()
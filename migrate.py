@@ -0,0 +1,13 @@
+import os
+from alembic import command
+from alembic.config import Config
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def upgrade(connection, revision="head"):
+    """Migrates the schema over an open sync connection, e.g. from AsyncConnection.run_sync."""
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    config.attributes["connection"] = connection
+    command.upgrade(config, revision)
@@ -0,0 +1,101 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-08-14 10:00:00
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases created by the old create_all() already have these tables;
+    # offline (--sql) scripts are for empty databases
+    existing = set() if context.is_offline_mode() else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", postgresql.UUID(as_uuid=False), primary_key=True),
+            sa.Column("name", sa.String()),
+            sa.Column("email", sa.String()),
+            sa.Column("password", sa.String()),
+            sa.Column("status", sa.Boolean()),
+            sa.Column("created_on", sa.DateTime()),
+            sa.Column("last_updated", sa.DateTime()),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "token" not in existing:
+        op.create_table(
+            "token",
+            sa.Column("token", postgresql.UUID(as_uuid=False), primary_key=True),
+            sa.Column("user", postgresql.UUID(), sa.ForeignKey("users.id", ondelete="cascade")),
+            sa.Column("created_on", sa.DateTime()),
+        )
+        op.create_index("ix_token_token", "token", ["token"])
+
+    if "code" not in existing:
+        op.create_table(
+            "code",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("code", sa.Integer()),
+            sa.Column("attempts", sa.Integer()),
+            sa.Column("step", sa.String()),
+            sa.Column("user", postgresql.UUID(), sa.ForeignKey("users.id", ondelete="cascade")),
+            sa.Column("update_on", sa.DateTime()),
+        )
+
+    if "request" not in existing:
+        op.create_table(
+            "request",
+            sa.Column("id", postgresql.UUID(as_uuid=False), primary_key=True),
+            sa.Column("step", sa.String()),
+            sa.Column("user", postgresql.UUID(), sa.ForeignKey("users.id", ondelete="cascade")),
+        )
+        op.create_index("ix_request_id", "request", ["id"])
+
+    if "faQ" not in existing:
+        op.create_table(
+            "faQ",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("question_en", sa.String()),
+            sa.Column("question_it", sa.String()),
+            sa.Column("answer_en", sa.String()),
+            sa.Column("answer_it", sa.String()),
+        )
+
+    if "videos" not in existing:
+        op.create_table(
+            "videos",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("preview", sa.String()),
+            sa.Column("title_en", sa.String()),
+            sa.Column("title_it", sa.String()),
+            sa.Column("description_en", sa.String()),
+            sa.Column("description_it", sa.String()),
+            sa.Column("link", sa.String()),
+        )
+
+    if "numbers" not in existing:
+        op.create_table(
+            "numbers",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("number", sa.Integer(), unique=True),
+            sa.Column("description_en", sa.String()),
+            sa.Column("description_it", sa.String()),
+        )
+
+
+def downgrade() -> None:
+    for table in ("numbers", "videos", "faQ", "request", "code", "token", "users"):
+        op.drop_table(table)
@@ -0,0 +1,29 @@
+"""indexes for code, token and request lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-08-14 10:30:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Latest code for a user and step: equality on (user, step), then the highest id
+    op.create_index("ix_code_user_step_id", "code", ["user", "step", "id"])
+    # Revoking all of a user's tokens
+    op.create_index("ix_token_user", "token", ["user"])
+    # get_request is served by the primary key; this one keeps the cascade from users cheap
+    op.create_index("ix_request_user", "request", ["user"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_request_user", table_name="request")
+    op.drop_index("ix_token_user", table_name="token")
+    op.drop_index("ix_code_user_step_id", table_name="code")
@@ -0,0 +1,30 @@
+"""request creation time and indexes for the expiry sweeps
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2023-08-21 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing requests keep a NULL creation time, which the reaper treats as expired
+    op.add_column("request", sa.Column("created_on", sa.DateTime()))
+    op.create_index("ix_request_created_on", "request", ["created_on"])
+    op.create_index("ix_token_created_on", "token", ["created_on"])
+    op.create_index("ix_code_update_on", "code", ["update_on"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_code_update_on", table_name="code")
+    op.drop_index("ix_token_created_on", table_name="token")
+    op.drop_index("ix_request_created_on", table_name="request")
+    op.drop_column("request", "created_on")
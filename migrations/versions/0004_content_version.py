@@ -0,0 +1,28 @@
+"""change counters for the content tables
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2023-08-28 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    table = op.create_table(
+        "content_version",
+        sa.Column("table_name", sa.String(), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.bulk_insert(table, [{"table_name": name, "version": 0} for name in ("faQ", "videos", "numbers")])
+
+
+def downgrade() -> None:
+    op.drop_table("content_version")
@@ -0,0 +1,33 @@
+"""drop the id indexes duplicating primary keys
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2023-08-29 10:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+# Indexes from 0001 that copy the primary key of their table; each one is written on every insert
+# and gives the planner a second choice for lookups the primary key already serves
+DUPLICATES = (
+    ("ix_users_id", "users", "id"),
+    ("ix_token_token", "token", "token"),
+    ("ix_request_id", "request", "id"),
+)
+
+
+def upgrade() -> None:
+    for name, table, column in DUPLICATES:
+        op.drop_index(name, table_name=table)
+
+
+def downgrade() -> None:
+    for name, table, column in DUPLICATES:
+        op.create_index(name, table, [column])
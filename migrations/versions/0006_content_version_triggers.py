@@ -0,0 +1,50 @@
+"""bump the content change counters from the database
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2023-08-30 10:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+CONTENT_TABLES = ("faQ", "videos", "numbers")
+
+
+def upgrade() -> None:
+    # Content is edited directly in the database, so the counters behind the ETags are bumped
+    # by triggers rather than by the app
+    if op.get_context().dialect.name == "postgresql":
+        op.execute("""
+            CREATE FUNCTION bump_content_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE content_version SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        for table in CONTENT_TABLES:
+            op.execute(f'CREATE TRIGGER "{table}_content_version" AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                       f'ON "{table}" FOR EACH STATEMENT EXECUTE FUNCTION bump_content_version()')
+    else:
+        # SQLite only has row triggers, one per event
+        for table in CONTENT_TABLES:
+            for action in ("insert", "update", "delete"):
+                op.execute(f'CREATE TRIGGER "{table}_content_version_{action}" AFTER {action.upper()} ON "{table}" '
+                           f"BEGIN UPDATE content_version SET version = version + 1 WHERE table_name = '{table}'; END")
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == "postgresql":
+        for table in CONTENT_TABLES:
+            op.execute(f'DROP TRIGGER "{table}_content_version" ON "{table}"')
+        op.execute("DROP FUNCTION bump_content_version()")
+    else:
+        for table in CONTENT_TABLES:
+            for action in ("insert", "update", "delete"):
+                op.execute(f'DROP TRIGGER "{table}_content_version_{action}"')
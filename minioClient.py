@@ -1,47 +1,143 @@
+from datetime import timedelta
+from io import BytesIO
 from minio import Minio
+from minio.error import S3Error
+import urllib3
+from cache import TTLCache
+import metrics
+import images
 import os
 
+BUCKETS = ["avatars"]
+DEFAULT_AVATAR = "user.png"
+DEFAULT_AVATAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "media", DEFAULT_AVATAR)
+URL_EXPIRES = timedelta(seconds=int(os.getenv("MINIO_URL_EXPIRES", str(7 * 24 * 3600))))
+# Cached URLs are dropped well before their signature expires, so a URL handed out
+# from the cache is always valid for at least a minute
+URL_CACHE_TTL = min(float(os.getenv("MINIO_URL_CACHE_TTL", "3600")), URL_EXPIRES.total_seconds() - 60)
+# Missing objects are remembered briefly; uploads made through another worker show up after this
+MISSING_TTL = float(os.getenv("MINIO_MISSING_TTL", "30"))
+# Seconds to connect to MinIO and to wait for a response; an unreachable server fails fast
+CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", "60"))
+
 
 class MinioClient:
     def __init__(self):
-        buckets = ["avatars"]
+        # No requests are made here; buckets and the default avatar are set up by prepare()
+        self.urls = TTLCache(maxsize=int(os.getenv("MINIO_URL_CACHE_SIZE", "10000")), ttl=URL_CACHE_TTL)
         self.client = Minio(f'{os.getenv("MINIO_ROOT_HOST", "51.250.86.166")}:9000',
                             access_key=os.getenv("MINIO_ROOT_USER", "GermanAdmin"),
                             secret_key=os.getenv("MINIO_ROOT_PASSWORD", "German123Minio"),
-                            secure=False)
-        for bucket in buckets:
-            try:
-                self.client.make_bucket(bucket)
-            except:
-                pass
+                            secure=False,
+                            http_client=urllib3.PoolManager(
+                                timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+                                maxsize=10,
+                                retries=urllib3.Retry(total=2, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+                            ))
+
+    def prepare(self):
+        """Creates missing buckets, and uploads the default avatar and its variants only when they are missing."""
+        for bucket in BUCKETS:
+            with metrics.timer("minio", "bucket_exists"):
+                exists = self.client.bucket_exists(bucket)
+            if not exists:
+                with metrics.timer("minio", "make_bucket"):
+                    self.client.make_bucket(bucket)
+        if not self.exists("avatars", DEFAULT_AVATAR):
+            self.save_image("avatars", DEFAULT_AVATAR, DEFAULT_AVATAR_PATH)
+        if not all(self.exists("avatars", images.variant_name(DEFAULT_AVATAR, size)) for size in images.AVATAR_SIZES):
+            self.save_variants("avatars", DEFAULT_AVATAR)
+
+    def exists(self, bucket, file_name):
         try:
-            self.save_image("avatars", "user.png", "./media/user.png")
-        except:
-            pass
+            with metrics.timer("minio", "stat_object"):
+                self.client.stat_object(bucket, file_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchBucket"):
+                return False
+            raise
+        return True
 
     def get_url(self, bucket, file_name):
+        key = (bucket, file_name)
+        url = self.urls.get(key)
+        if url is not None:
+            return url or None
+
         try:
-            self.client.get_object(
-                bucket,
-                file_name
-            )
+            with metrics.timer("minio", "stat_object"):
+                self.client.stat_object(bucket, file_name)
+        except S3Error:
+            self.urls.set(key, "", ttl=MISSING_TTL)
+            return None
         except:
+            metrics.swallowed("minio.get_url")
             return None
 
         try:
-            return self.client.get_presigned_url(
-                "GET",
-                bucket,
-                file_name
-            )
+            with metrics.timer("minio", "presign"):
+                url = self.client.get_presigned_url(
+                    "GET",
+                    bucket,
+                    file_name,
+                    expires=URL_EXPIRES
+                )
         except:
+            metrics.swallowed("minio.get_url")
             return None
+        self.urls.set(key, url)
+        return url
+
+    def avatar_url(self, user_id, size=None):
+        # Until the resize worker has stored a user's variants, the original is served
+        names = [f"{user_id}.png", DEFAULT_AVATAR]
+        if size:
+            names = [images.variant_name(names[0], size), names[0], images.variant_name(DEFAULT_AVATAR, size), DEFAULT_AVATAR]
+        for name in names:
+            url = self.get_url("avatars", name)
+            if url:
+                return url
+        return None
 
     def save_image(self, bucket, file_name, file_path, content_type='image/png'):
         try:
-            self.client.fput_object(bucket, file_name, file_path, content_type=content_type)
-        except:
-            pass
+            with metrics.timer("minio", "fput_object"):
+                self.client.fput_object(bucket, file_name, file_path, content_type=content_type)
+        finally:
+            self.urls.pop((bucket, file_name))
+
+    def save_image_stream(self, bucket, file_name, data, content_type='image/png'):
+        # Unknown length: MinIO reads one part at a time, multipart once the data outgrows a part
+        try:
+            with metrics.timer("minio", "put_object"):
+                self.client.put_object(bucket, file_name, data, -1, content_type=content_type,
+                                       part_size=images.UPLOAD_PART_SIZE, num_parallel_uploads=1)
+        finally:
+            self.urls.pop((bucket, file_name))
+
+    def save_variants(self, bucket, file_name):
+        with metrics.timer("minio", "get_object"):
+            response = self.client.get_object(bucket, file_name)
+            try:
+                data = response.read()
+            finally:
+                response.close()
+                response.release_conn()
 
-    def save_image_bytes(self, bucket, file_name, data, length, content_type='image/png'):
-        self.client.put_object(bucket, file_name, data, length, content_type=content_type)
+        names = {size: images.variant_name(file_name, size) for size in images.AVATAR_SIZES}
+        try:
+            encoded = images.variants(data)
+        except:
+            # Variants of a previous upload would otherwise keep being served
+            for name in names.values():
+                with metrics.timer("minio", "remove_object"):
+                    self.client.remove_object(bucket, name)
+                self.urls.pop((bucket, name))
+            raise
+        for size, name in names.items():
+            try:
+                with metrics.timer("minio", "put_object"):
+                    self.client.put_object(bucket, name, BytesIO(encoded[size]), len(encoded[size]), content_type="image/webp")
+            finally:
+                self.urls.pop((bucket, name))
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Boolean, DateTime, Column, text, ForeignKey, Integer, String, LargeBinary
+from sqlalchemy import Boolean, DateTime, Column, text, ForeignKey, Index, Integer, String, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID
 from database import Base
 from uuid import uuid4
@@ -8,7 +8,7 @@ from uuid import uuid4
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=False), primary_key=True, index=True, default=uuid4)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=uuid4)
     name = Column(String)
     email = Column(String, unique=True, index=True)
     password = Column(String)
@@ -19,14 +19,22 @@ class User(Base):
 
 class Token(Base):
     __tablename__ = "token"
+    __table_args__ = (
+        Index("ix_token_user", "user"),
+        Index("ix_token_created_on", "created_on"),
+    )
 
-    token = Column(UUID(as_uuid=False), primary_key=True, index=True, default=uuid4)
+    token = Column(UUID(as_uuid=False), primary_key=True, default=uuid4)
     user = Column(UUID, ForeignKey("users.id", ondelete="cascade"))
     created_on = Column(DateTime, default=datetime.datetime.now)
 
 
 class Code(Base):
     __tablename__ = "code"
+    __table_args__ = (
+        Index("ix_code_user_step_id", "user", "step", "id"),
+        Index("ix_code_update_on", "update_on"),
+    )
 
     id = Column(Integer, primary_key=True)
     code = Column(Integer)
@@ -38,10 +46,15 @@ class Code(Base):
 
 class Request(Base):
     __tablename__ = "request"
+    __table_args__ = (
+        Index("ix_request_user", "user"),
+        Index("ix_request_created_on", "created_on"),
+    )
 
-    id = Column(UUID(as_uuid=False), primary_key=True, index=True, default=uuid4)
+    id = Column(UUID(as_uuid=False), primary_key=True, default=uuid4)
     step = Column(String)
     user = Column(UUID, ForeignKey("users.id", ondelete="cascade"))
+    created_on = Column(DateTime, default=datetime.datetime.now)
 
 
 class FaQ(Base):
@@ -74,3 +87,10 @@ class Numbers(Base):
     description_en = Column(String)
     description_it = Column(String)
 
+
+# Change counter per content table, bumped by database triggers on every write to it (migration 0006)
+class ContentVersion(Base):
+    __tablename__ = "content_version"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
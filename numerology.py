@@ -0,0 +1,233 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+from types import MappingProxyType
+import numpy as np
+from sqlalchemy import select
+import content
+import metrics
+import models
+from database import SessionLocal
+
+LANGS = ("en", "it")
+NUMBER_INDEX_PATH = os.getenv("NUMBER_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "numbers.idx"))
+# Results per chunk of a streamed batch response
+BATCH_CHUNK = 1024
+# Seconds between checks of the numbers change counter, so direct edits are reloaded; 0 disables them
+NUMBERS_POLL = float(os.getenv("NUMBERS_POLL", str(content.CONTENT_STATS_TTL)))
+
+logger = logging.getLogger(__name__)
+
+
+class NumbersTable:
+    """Immutable snapshot of the numbers table for one language."""
+
+    def __init__(self, rows, lang):
+        self.rows = MappingProxyType({
+            row.number: {
+                "id": row.id,
+                "number": row.number,
+                "description": getattr(row, f"description_{lang}"),
+            }
+            for row in rows
+        })
+        # Batch lookups: digit sum -> position in `encoded`, where position 0 is JSON null
+        size = max(self.rows, default=0) + 1
+        self.index = np.zeros(size, dtype=np.intp)
+        self.encoded = [b"null"]
+        for number, row in self.rows.items():
+            if number >= 0:
+                self.index[number] = len(self.encoded)
+                self.encoded.append(json.dumps(row, ensure_ascii=False).encode('utf-8'))
+
+
+class DateIndex:
+    """
+    Precomputed digit sums for every date in a range, memory-mapped so all workers share one copy.
+
+    File layout: 8-byte magic, little-endian int32 ordinal of the first date, int32 number of days,
+    then one uint8 row per day holding the digit sum of the day and of the full YYYYMMDD date.
+    Built by build_number_index.py.
+    """
+
+    MAGIC = b"NUMIDX01"
+    HEADER = np.dtype([("magic", "S8"), ("first", "<i4"), ("days", "<i4")])
+    DAY, FULL_DATE = 0, 1
+
+    def __init__(self, first=0, data=None):
+        self.first = first
+        self.data = np.zeros((0, 2), dtype=np.uint8) if data is None else data
+
+    @classmethod
+    def open(cls, path=NUMBER_INDEX_PATH):
+        if not os.path.exists(path):
+            return cls()
+        header = np.fromfile(path, dtype=cls.HEADER, count=1)[0]
+        if header["magic"] != cls.MAGIC:
+            raise ValueError(f"{path} is not a number index")
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=cls.HEADER.itemsize, shape=(int(header["days"]), 2))
+        return cls(int(header["first"]), data)
+
+    @classmethod
+    def write(cls, path, first: datetime.date, last: datetime.date):
+        dates = np.arange(np.datetime64(first, "D"), np.datetime64(last, "D") + 1)
+        years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        months = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        days = (dates - dates.astype("datetime64[M]")).astype(np.int64) + 1
+        data = np.stack([digit_sums(days), digit_sums(years * 10000 + months * 100 + days)], axis=1).astype(np.uint8)
+        header = np.array([(cls.MAGIC, first.toordinal(), len(dates))], dtype=cls.HEADER)
+        with open(path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(data.tobytes())
+
+    def offsets(self, ordinals):
+        offsets = np.asarray(ordinals, dtype=np.int64) - self.first
+        return offsets, (offsets >= 0) & (offsets < len(self.data))
+
+    def day_number(self, date: datetime.date):
+        offset = date.toordinal() - self.first
+        if 0 <= offset < len(self.data):
+            return int(self.data[offset, self.DAY])
+        return None
+
+
+date_index = DateIndex()
+
+
+def open_index(path=NUMBER_INDEX_PATH):
+    global date_index
+    date_index = DateIndex.open(path)
+
+
+_tables = MappingProxyType({lang: NumbersTable((), lang) for lang in LANGS})
+version = content.digest(())
+_reloads = set()
+# Change counter of the numbers table when the installed rows were read
+_loaded_version = None
+_watcher = None
+
+
+def install(rows):
+    global _tables, version
+    _tables = MappingProxyType({lang: NumbersTable(rows, lang) for lang in LANGS})
+    version = content.digest(sorted((row.id, row.number, row.description_en, row.description_it) for row in rows))
+
+
+async def _stored_version(db):
+    return await db.scalar(select(models.ContentVersion.version).where(
+        models.ContentVersion.table_name == models.Numbers.__tablename__))
+
+
+async def reload():
+    global _loaded_version
+    async with SessionLocal() as db:
+        # Read before the rows: an edit in between only costs one more reload
+        stored = await _stored_version(db)
+        rows = (await db.scalars(select(models.Numbers))).all()
+    install(rows)
+    _loaded_version = stored
+
+
+async def _watch(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with SessionLocal() as db:
+                stored = await _stored_version(db)
+            if stored != _loaded_version:
+                await reload()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.swallowed("numerology.watch")
+            logger.exception("Reloading numbers failed")
+
+
+def start_watching(interval=NUMBERS_POLL):
+    """Reloads the numbers whenever their change counter moves, which also covers direct edits."""
+    global _watcher
+    if interval > 0 and _watcher is None:
+        _watcher = asyncio.get_running_loop().create_task(_watch(interval))
+
+
+async def stop_watching():
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
+
+
+def _table(lang: str):
+    return _tables["en" if lang == "en" else "it"]
+
+
+def lookup(number: int, lang: str = "en"):
+    return _table(lang).rows.get(number)
+
+
+def digit_sums(values):
+    values = np.array(values, dtype=np.int64)
+    # Floor division never takes a negative value to 0, so the loop below would not end
+    if (values < 0).any():
+        raise ValueError("Digit sums of negative values are undefined")
+    result = np.zeros_like(values)
+    while values.any():
+        result += values % 10
+        values //= 10
+    return result
+
+
+def parse_dates(dates):
+    """Parses YYYY-MM-DD strings in one pass, raising ValueError on anything else."""
+    raw = np.asarray(dates, dtype=str)
+    parsed = raw.astype("datetime64[D]")
+    # numpy also accepts partial dates and "NaT"; only exact round trips are valid
+    if np.isnat(parsed).any() or not np.array_equal(parsed.astype(str), raw):
+        raise ValueError("Invalid date")
+    return parsed
+
+
+# date.toordinal() of 1970-01-01, the datetime64 epoch
+_EPOCH_ORDINAL = 719163
+
+
+def batch_numbers(dates, lang: str = "en"):
+    parsed = parse_dates(dates)
+    offsets, indexed = date_index.offsets(parsed.astype(np.int64) + _EPOCH_ORDINAL)
+    sums = np.empty(len(parsed), dtype=np.int64)
+    sums[indexed] = date_index.data[offsets[indexed], DateIndex.DAY]
+    if not indexed.all():
+        rest = parsed[~indexed]
+        sums[~indexed] = digit_sums((rest - rest.astype("datetime64[M]")).astype(np.int64) + 1)
+    table = _table(lang)
+    positions = np.zeros(len(sums), dtype=np.intp)
+    known = sums < len(table.index)
+    positions[known] = table.index[sums[known]]
+    return table, positions
+
+
+def stream_json(table, positions):
+    encoded = table.encoded
+    yield b"["
+    for start in range(0, len(positions), BATCH_CHUNK):
+        chunk = b",".join([encoded[i] for i in positions[start:start + BATCH_CHUNK].tolist()])
+        yield chunk if start == 0 else b"," + chunk
+    yield b"]"
+
+
+def _schedule_reload():
+    try:
+        task = asyncio.get_running_loop().create_task(reload())
+    except RuntimeError:
+        return
+    _reloads.add(task)
+    task.add_done_callback(_reloads.discard)
+
+
+content.on_change(models.Numbers.__tablename__, _schedule_reload)
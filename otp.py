@@ -0,0 +1,163 @@
+import datetime
+import os
+import secrets
+import time
+from cache import TTLCache
+import crud
+
+# memory: one process only; redis: shared by every worker; db: the code table
+OTP_STORE = os.getenv("OTP_STORE", "memory")
+OTP_REDIS_URL = os.getenv("OTP_REDIS_URL", "redis://redis:6379/0")
+OTP_MEMORY_SIZE = int(os.getenv("OTP_MEMORY_SIZE", "100000"))
+
+# Seconds a code stays valid, seconds before a new one can be sent, and wrong guesses allowed
+OTP_TTL = int(os.getenv("OTP_TTL", "300"))
+OTP_COOLDOWN = int(os.getenv("OTP_COOLDOWN", "60"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "3"))
+# Expired codes are kept as long again, so a late attempt is told the code is outdated, not missing
+OTP_RETAIN = OTP_TTL * 2
+
+# verify() results
+OK, MISSING, EXPIRED, INCORRECT = "ok", "missing", "expired", "incorrect"
+
+
+class Cooldown(Exception):
+    def __init__(self, seconds: int):
+        super().__init__(f"Please wait [{seconds}] seconds")
+        self.seconds = seconds
+
+
+def new_code():
+    return str(1000 + secrets.randbelow(9000))
+
+
+def _wait(issued: float, now: float):
+    return OTP_COOLDOWN - int(now - issued)
+
+
+class MemoryStore:
+    """Codes in a TTL cache. Each operation runs without awaiting, so it is atomic on the event loop."""
+
+    def __init__(self, maxsize=OTP_MEMORY_SIZE):
+        self.codes = TTLCache(maxsize=maxsize, ttl=OTP_RETAIN)
+
+    async def issue(self, db, user_id, step: str):
+        key = (step, str(user_id))
+        now = time.time()
+        record = self.codes.get(key)
+        if record is not None and _wait(record["issued"], now) >= 0:
+            raise Cooldown(_wait(record["issued"], now))
+        code = new_code()
+        self.codes.set(key, {"code": code, "attempts": 0, "issued": now})
+        return code
+
+    async def verify(self, db, user_id, step: str, code: str):
+        key = (step, str(user_id))
+        record = self.codes.get(key)
+        if record is None:
+            return MISSING
+        if time.time() - record["issued"] > OTP_TTL:
+            self.codes.pop(key)
+            return EXPIRED
+        record["attempts"] += 1
+        if record["code"] == code:
+            self.codes.pop(key)
+            return OK
+        if record["attempts"] >= OTP_MAX_ATTEMPTS:
+            self.codes.pop(key)
+        return INCORRECT
+
+
+_REDIS_ISSUE = """
+local issued = redis.call('HGET', KEYS[1], 'issued')
+local now = tonumber(ARGV[1])
+if issued then
+    local wait = tonumber(ARGV[3]) - math.floor(now - tonumber(issued))
+    if wait >= 0 then
+        return wait
+    end
+end
+redis.call('HSET', KEYS[1], 'code', ARGV[2], 'attempts', 0, 'issued', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return -1
+"""
+
+_REDIS_VERIFY = """
+local record = redis.call('HMGET', KEYS[1], 'code', 'issued')
+if not record[1] then
+    return 'missing'
+end
+if tonumber(ARGV[1]) - tonumber(record[2]) > tonumber(ARGV[3]) then
+    redis.call('DEL', KEYS[1])
+    return 'expired'
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if record[1] == ARGV[2] then
+    redis.call('DEL', KEYS[1])
+    return 'ok'
+end
+if attempts >= tonumber(ARGV[4]) then
+    redis.call('DEL', KEYS[1])
+end
+return 'incorrect'
+"""
+
+
+class RedisStore:
+    """Codes in Redis hashes that expire natively; issue and verify are single Lua scripts."""
+
+    def __init__(self, url=OTP_REDIS_URL):
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(url, decode_responses=True)
+        self._issue = self.redis.register_script(_REDIS_ISSUE)
+        self._verify = self.redis.register_script(_REDIS_VERIFY)
+
+    async def issue(self, db, user_id, step: str):
+        code = new_code()
+        wait = await self._issue(keys=[f"otp:{step}:{user_id}"], args=[time.time(), code, OTP_COOLDOWN, OTP_RETAIN])
+        if wait >= 0:
+            raise Cooldown(wait)
+        return code
+
+    async def verify(self, db, user_id, step: str, code: str):
+        return await self._verify(keys=[f"otp:{step}:{user_id}"], args=[time.time(), code, OTP_TTL, OTP_MAX_ATTEMPTS])
+
+
+class DatabaseStore:
+    """Codes in the code table; an attempt is counted by one conditional UPDATE."""
+
+    async def issue(self, db, user_id, step: str):
+        codeObj = await crud.get_code(db=db, user_id=user_id, step=step)
+        now = datetime.datetime.now().timestamp()
+        if codeObj and _wait(codeObj.update_on.timestamp(), now) >= 0:
+            raise Cooldown(_wait(codeObj.update_on.timestamp(), now))
+        value = int(new_code())
+        if codeObj:
+            codeObj = await crud.update_code(db=db, code=codeObj, value=value)
+        else:
+            codeObj = await crud.create_code(db=db, user_id=user_id, step=step, value=value)
+        return str(codeObj.code) if codeObj else None
+
+    async def verify(self, db, user_id, step: str, code: str):
+        claimed = await crud.claim_code_attempt(db=db, user_id=user_id, step=step, max_attempts=OTP_MAX_ATTEMPTS)
+        if claimed is None:
+            return MISSING
+        if datetime.datetime.now().timestamp() - claimed.update_on.timestamp() > OTP_TTL:
+            await crud.remove_codes(db=db, user_id=user_id, step=step)
+            return EXPIRED
+        if str(claimed.code) == code:
+            await crud.remove_codes(db=db, user_id=user_id, step=step)
+            return OK
+        if claimed.attempts >= OTP_MAX_ATTEMPTS:
+            await crud.remove_codes(db=db, user_id=user_id, step=step)
+        return INCORRECT
+
+
+STORES = {
+    "memory": MemoryStore,
+    "redis": RedisStore,
+    "db": DatabaseStore,
+}
+
+store = STORES[OTP_STORE]()
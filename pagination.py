@@ -0,0 +1,27 @@
+import base64
+import binascii
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_id: int):
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        key, value = raw.split(":", 1)
+        if key != "id":
+            raise InvalidCursor(cursor)
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def next_cursor(rows, limit: int):
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+import metrics
+from database import engine
+
+# Statements slower than this many milliseconds are logged with their parameters, -1 disables
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))
+# Bound values can hold emails, password digests and codes, so they are only logged when asked for
+SQL_LOG_PARAMS = os.getenv("SQL_LOG_PARAMS", "0").lower() in ("1", "true", "yes")
+# Adds the per-request query summary as a Server-Timing header and logs repeated statements
+DEBUG = os.getenv("DEBUG", "0").lower() in ("1", "true", "yes")
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+db_queries = metrics.registry.histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request", ("route",), QUERY_BUCKETS)
+db_time = metrics.registry.histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("route",))
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("sql_profile", default=None)
+
+
+def _route(scope):
+    # Raw paths would let any client create new metric labels
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+class RequestProfile:
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    @property
+    def route(self):
+        # The router fills in the matched route once the request reaches it
+        return _route(self.scope)
+
+    def add(self, statement, parameters, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement, repr(parameters)] += 1
+
+    def repeated(self):
+        """Identical statements (same SQL and parameters) run more than once, with their counts."""
+        return {key: n for key, n in self.statements.items() if n > 1}
+
+    def summary(self):
+        repeated = sum(n - 1 for n in self.repeated().values())
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.queries} queries, {repeated} repeated"'
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    profile = _current.get()
+    if profile is not None:
+        profile.add(statement, parameters, seconds)
+    if 0 <= SQL_SLOW_MS <= seconds * 1000:
+        route = profile.route if profile is not None else "-"
+        logger.warning("slow query %.1f ms [%s]: %s %s", seconds * 1000, route, statement,
+                       repr(parameters) if SQL_LOG_PARAMS else "(parameters hidden)")
+
+
+class ProfilerMiddleware:
+    """Pure ASGI middleware collecting the SQL run while serving each request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile(scope)
+        token = _current.set(profile)
+
+        async def send_wrapper(message):
+            if DEBUG and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.summary().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = profile.route
+            db_queries.labels(route).observe(profile.queries)
+            db_time.labels(route).observe(profile.seconds)
+            if DEBUG:
+                for (statement, parameters), n in profile.repeated().items():
+                    logger.info("repeated query x%d [%s]: %s %s", n, route, statement,
+                                parameters if SQL_LOG_PARAMS else "(parameters hidden)")
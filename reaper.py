@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+import logging
+import os
+import crud
+import metrics
+import models
+import otp
+from database import SessionLocal
+
+# Seconds between sweeps, 0 disables the reaper
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "300"))
+# Rows deleted per statement; every batch is its own short transaction
+REAPER_BATCH = int(os.getenv("REAPER_BATCH", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+def _targets(now: datetime.datetime):
+    targets = [
+        ("code", models.Code, models.Code.update_on, now - datetime.timedelta(seconds=otp.OTP_RETAIN)),
+        ("request", models.Request, models.Request.created_on, now - datetime.timedelta(seconds=crud.REQUEST_TTL)),
+    ]
+    if crud.TOKEN_TTL > 0:
+        targets.append(("token", models.Token, models.Token.created_on, now - datetime.timedelta(seconds=crud.TOKEN_TTL)))
+    return targets
+
+
+class Reaper:
+    """Deletes expired codes, forgot-password requests and tokens in small batches."""
+
+    def __init__(self, interval=REAPER_INTERVAL, batch=REAPER_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self.runs = 0
+        self.last_run = None
+        self.last_removed = {}
+        self._task = None
+
+    async def run_once(self):
+        removed = {}
+        for name, model, column, cutoff in _targets(datetime.datetime.now()):
+            removed[name] = 0
+            while True:
+                async with SessionLocal() as db:
+                    count = await crud.remove_expired(db, model, column, cutoff, self.batch)
+                    await db.commit()
+                removed[name] += count
+                if count < self.batch:
+                    break
+        self.runs += 1
+        self.last_run = datetime.datetime.now()
+        self.last_removed = removed
+        return removed
+
+    async def _loop(self):
+        while True:
+            try:
+                removed = await self.run_once()
+                if any(removed.values()):
+                    logger.info("removed %s", removed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.swallowed("reaper")
+                logger.exception("Reaper sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "last_removed": self.last_removed,
+        }
+
+
+reaper = Reaper()
@@ -1,65 +1,102 @@
+import os
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, List
 from fastapi import APIRouter
-from sqlalchemy.orm import Session
-from fastapi import Depends, FastAPI, HTTPException, Form, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, FastAPI, HTTPException, Form, UploadFile, File, Request, Response
+from fastapi.responses import StreamingResponse
 import schemas
+import content
 import crud
-from database import SessionLocal
+import models
+import numerology
+from database import get_db
+from pagination import InvalidCursor, decode_cursor, next_cursor
+
+NUMBER_BATCH_MAX = int(os.getenv("NUMBER_BATCH_MAX", "10000"))
+CONTENT_CACHE_CONTROL = f'private, max-age={int(os.getenv("CONTENT_MAX_AGE", "60"))}, must-revalidate'
 
 api_router = APIRouter()
 
 
-def get_db():
-    db = SessionLocal()
+def _not_modified(request: Request, response: Response, etag: str):
+    headers = {"ETag": etag, "Cache-Control": CONTENT_CACHE_CONTROL}
+    response.headers.update(headers)
+    tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in tags or "*" in tags:
+        raise HTTPException(status_code=304, headers=headers)
+
+
+def conditional(model):
+    # The answer to If-None-Match only needs the cached table version, not a query
+    async def dependency(request: Request, response: Response, db: Annotated[AsyncSession, Depends(get_db)]):
+        version = await content.get_version(db, model)
+        _not_modified(request, response, f'"{model.__tablename__}-{version}"')
+    return Depends(dependency)
+
+
+async def numbers_conditional(request: Request, response: Response):
+    _not_modified(request, response, f'"numbers-{numerology.version}"')
+
+
+def _after_id(cursor: str | None):
+    if cursor is None:
+        return None
     try:
-        yield db
-    finally:
-        db.close()
+        return decode_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
-@api_router.get("/videos/", tags=['main_screen'], response_model=schemas.Videos)
+@api_router.get("/videos/", tags=['main_screen'], response_model=schemas.Videos,
+                dependencies=[conditional(models.Videos)])
 async def videos(
-        db: Annotated[Session, Depends(get_db)],
-        offset: int,
+        db: Annotated[AsyncSession, Depends(get_db)],
         limit: int,
+        offset: int | None = None,
+        cursor: str | None = None,
         lang: str = "en"
 ):
-    total, query = crud.get_videos(db, offset, limit, lang)
+    total, videos = await crud.get_videos(db, offset, limit, lang, after_id=_after_id(cursor))
     return {
-        "videos": query,
-        "count": query.count(),
-        "total": total
+        "videos": videos,
+        "count": len(videos),
+        "total": total,
+        "next_cursor": next_cursor(videos, limit)
     }
 
 
-@api_router.get("/faqs/", tags=['main_screen'], response_model=schemas.FaQs)
+@api_router.get("/faqs/", tags=['main_screen'], response_model=schemas.FaQs,
+                dependencies=[conditional(models.FaQ)])
 async def faqs(
-        db: Annotated[Session, Depends(get_db)],
-        offset: int,
+        db: Annotated[AsyncSession, Depends(get_db)],
         limit: int,
+        offset: int | None = None,
+        cursor: str | None = None,
         lang: str = "en"
 ):
-    total, query = crud.get_questions(db, offset, limit, lang)
+    total, questions = await crud.get_questions(db, offset, limit, lang, after_id=_after_id(cursor))
     return {
-        "questions": query,
-        "count": query.count(),
-        "total": total
+        "questions": questions,
+        "count": len(questions),
+        "total": total,
+        "next_cursor": next_cursor(questions, limit)
     }
 
 
-@api_router.get("/faqs/{faq_id}", tags=['main_screen'], response_model=schemas.FaQDetail)
+@api_router.get("/faqs/{faq_id}", tags=['main_screen'], response_model=schemas.FaQDetail,
+                dependencies=[conditional(models.FaQ)])
 async def fsq(
-        db: Annotated[Session, Depends(get_db)],
+        db: Annotated[AsyncSession, Depends(get_db)],
         faq_id: int,
         lang: str = "en"
 ):
-    return crud.get_question_by_id(db, faq_id, lang)
+    return await crud.get_question_by_id(db, faq_id, lang)
 
 
-@api_router.get("/number/", tags=['main_screen'], response_model=schemas.NumbersBase | None)
+@api_router.get("/number/", tags=['main_screen'], response_model=schemas.NumbersBase | None,
+                dependencies=[Depends(numbers_conditional)])
 async def number(
-        db: Annotated[Session, Depends(get_db)],
         date: str,
         lang: str = "en"
 ):
@@ -67,4 +104,17 @@ async def number(
         valid_date = datetime.strptime(date, '%Y-%m-%d')
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date")
-    return crud.get_number(db, valid_date, lang)
+    return crud.get_number(valid_date, lang)
+
+
+@api_router.post("/number/batch", tags=['main_screen'], response_model=List[schemas.NumbersBase | None])
+async def number_batch(
+        o: schemas.NumbersBatch
+):
+    if len(o.dates) > NUMBER_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {NUMBER_BATCH_MAX} dates per request")
+    try:
+        table, positions = numerology.batch_numbers(o.dates, o.lang)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    return StreamingResponse(numerology.stream_json(table, positions), media_type="application/json")
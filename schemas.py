@@ -1,7 +1,12 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Literal, Optional, List
+from uuid import UUID
 
 from pydantic import BaseModel
 
+# Stored avatar variants, see images.AVATAR_SIZES
+AvatarSize = Literal["thumb", "medium"]
+
 
 class UserCreate(BaseModel):
     name: str
@@ -72,6 +77,16 @@ class UserResult(BaseModel):
         from_attributes = True
 
 
+class TokenBase(BaseModel):
+    token: str
+    user: UUID
+    created_on: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
+
 class NumbersBase(BaseModel):
     id: int
     number: int
@@ -81,6 +96,14 @@ class NumbersBase(BaseModel):
         from_attributes = True
 
 
+class NumbersBatch(BaseModel):
+    dates: List[str]
+    lang: str = "en"
+
+    class Config:
+        from_attributes = True
+
+
 class FaQBase(BaseModel):
     id: int
     question: str
@@ -108,6 +131,7 @@ class Videos(BaseModel):
     videos: List[VideoBase]
     count: int
     total: int
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -117,6 +141,7 @@ class FaQs(BaseModel):
     questions: List[FaQBase]
     count: int
     total: int
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
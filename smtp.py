@@ -1,9 +1,32 @@
+import os
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import socket
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.mime.base import MIMEBase
 from email.encoders import encode_base64
 from os import path
+import mail_templates
+import metrics
+from hashing import PoolBusy
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.yandex.ru")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_USER = os.getenv("SMTP_USER", "Arthut1@yandex.ru")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "KarateCan120")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+# Mail servers drop idle sessions, so connections idle longer than this are not reused
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+# Messages waiting or being sent; beyond this new mail is rejected with 503
+SMTP_QUEUE = int(os.getenv("SMTP_QUEUE", "100"))
+
+
+class MailQueueFull(PoolBusy):
+    pass
 
 
 def attach_file(filepath):
@@ -18,33 +41,147 @@ def attach_file(filepath):
     return part
 
 
-def send_email(addressees, theme="Регистрация", code="5555", text="Спасибо за регистрацию", port=465):
-    sender = "Arthut1@yandex.ru"
-    password = "KarateCan120"
-    host = "smtp.yandex.ru"
+def build_message(addressees, theme="Регистрация", code="5555", text="Спасибо за регистрацию", sender=SMTP_USER):
+    return mail_templates.render(addressees, theme=theme, text=text, code=code, sender=sender)
+
+
+@metrics.timed("smtp")
+def connect():
+    server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        server.login(SMTP_USER, SMTP_PASSWORD)
+    except:
+        server.close()
+        raise
+    return server
+
+
+class SMTPPool:
+    """Keeps up to `size` authenticated SMTP connections and hands them out for reuse."""
+
+    def __init__(self, size=SMTP_POOL_SIZE, factory=connect, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.size = size
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.factory()
+                if time.monotonic() - last_used < self.idle_timeout:
+                    return server
+                self._close(server)
+        except:
+            self._slots.release()
+            raise
+
+    def release(self, server, broken=False):
+        if broken:
+            self._close(server)
+        else:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def sendmail(self, sender, addressees, message):
+        # A pooled connection may have been dropped by the server; retry once on a fresh one
+        for attempt in range(2):
+            server = self.acquire()
+            try:
+                with metrics.timer("smtp", "sendmail"):
+                    server.sendmail(sender, addressees, message)
+            # Only a dropped connection is retried; any other SMTP error may come after the message was accepted
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                self.release(server, broken=True)
+                if attempt:
+                    raise
+            except:
+                self.release(server, broken=True)
+                raise
+            else:
+                self.release(server)
+                return
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(server)
 
-    html = """
-<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd"><html xmlns="http://www.w3.org/1999/xhtml" xmlns:o="urn:schemas-microsoft-com:office:office"><head><meta charset="UTF-8"><meta content="width=device-width, initial-scale=1" name="viewport"><meta name="x-apple-disable-message-reformatting"><meta http-equiv="X-UA-Compatible" content="IE=edge"><meta content="telephone=no" name="format-detection"><title>Upcoming event</title><!--[if (mso 16)]><style type="text/css"> a {text-decoration: none;} </style><![endif]--><!--[if gte mso 9]><style>sup { font-size: 100% !important; }</style><![endif]--><!--[if gte mso 9]><xml> <o:OfficeDocumentSettings> <o:AllowPNG></o:AllowPNG> <o:PixelsPerInch>96</o:PixelsPerInch> </o:OfficeDocumentSettings> </xml><![endif]--><!--[if !mso]><!-- --><link rel="stylesheet" href="https://fonts.googleapis.com/css?family=Roboto:400,400i,700,700i"><!--<![endif]--><style type="text/css">.rollover:hover .rollover-first { max-height:0px!important; display:none!important; } .rollover:hover .rollover-second { max-height:none!important; display:inline-block!important; } .rollover div { font-size:0px; } u ~ div img + div > div { display:none; } #outlook a { padding:0; } span.MsoHyperlink,span.MsoHyperlinkFollowed { color:inherit; mso-style-priority:99; } a.es-button { mso-style-priority:100!important; text-decoration:none!important; } a[x-apple-data-detectors] { color:inherit!important; text-decoration:none!important; font-size:inherit!important; font-family:inherit!important; font-weight:inherit!important; line-height:inherit!important; } .es-desk-hidden { display:none; float:left; overflow:hidden; width:0; max-height:0; line-height:0; mso-hide:all; } .es-header-body a:hover { color:#2cb543!important; } .es-content-body a:hover { color:#34297c!important; } .es-footer-body a:hover { color:#34297C!important; } .es-infoblock a:hover { color:#cccccc!important; } .es-button-border:hover > a.es-button { color:#ffffff!important; }@media only screen and (max-width:600px) {.es-m-p20r { padding-right:20px!important } .es-m-p20l { padding-left:20px!important } *[class="gmail-fix"] { display:none!important } p, a { line-height:150%!important } h1, h1 a { line-height:120%!important } h2, h2 a { line-height:120%!important } h3, h3 a { line-height:120%!important } h4, h4 a { line-height:120%!important } h5, h5 a { line-height:120%!important } h6, h6 a { line-height:120%!important } .es-header-body p { } .es-content-body p { } .es-footer-body p { } .es-infoblock p { } h1 { font-size:30px!important; text-align:left } h2 { font-size:24px!important; text-align:left } h3 { font-size:20px!important; text-align:left } h4 { font-size:24px!important; text-align:left } h5 { font-size:20px!important; text-align:left } h6 { font-size:16px!important; text-align:left } .es-header-body h1 a, .es-content-body h1 a, .es-footer-body h1 a { font-size:30px!important } .es-header-body h2 a, .es-content-body h2 a, .es-footer-body h2 a { font-size:24px!important } .es-header-body h3 a, .es-content-body h3 a, .es-footer-body h3 a { font-size:20px!important } .es-header-body h4 a, .es-content-body h4 a, .es-footer-body h4 a { font-size:24px!important } .es-header-body h5 a, .es-content-body h5 a, .es-footer-body h5 a { font-size:20px!important } .es-header-body h6 a, .es-content-body h6 a, .es-footer-body h6 a { font-size:16px!important } .es-menu td a { font-size:18px!important } .es-header-body p, .es-header-body a { font-size:12px!important } .es-content-body p, .es-content-body a { font-size:14px!important } .es-footer-body p, .es-footer-body a { font-size:12px!important } .es-infoblock p, .es-infoblock a { font-size:12px!important } .es-m-txt-c, .es-m-txt-c h1, .es-m-txt-c h2, .es-m-txt-c h3, .es-m-txt-c h4, .es-m-txt-c h5, .es-m-txt-c h6 { text-align:center!important } .es-m-txt-r, .es-m-txt-r h1, .es-m-txt-r h2, .es-m-txt-r h3, .es-m-txt-r h4, .es-m-txt-r h5, .es-m-txt-r h6 { text-align:right!important } .es-m-txt-j, .es-m-txt-j h1, .es-m-txt-j h2, .es-m-txt-j h3, .es-m-txt-j h4, .es-m-txt-j h5, .es-m-txt-j h6 { text-align:justify!important } .es-m-txt-l, .es-m-txt-l h1, .es-m-txt-l h2, .es-m-txt-l h3, .es-m-txt-l h4, .es-m-txt-l h5, .es-m-txt-l h6 { text-align:left!important } .es-m-txt-r img, .es-m-txt-c img, .es-m-txt-l img, .es-m-txt-r .rollover:hover .rollover-second, .es-m-txt-c .rollover:hover .rollover-second, .es-m-txt-l .rollover:hover .rollover-second { display:inline!important } .es-m-txt-r .rollover div, .es-m-txt-c .rollover div, .es-m-txt-l .rollover div { line-height:0!important; font-size:0!important } .es-spacer { display:inline-table } a.es-button, button.es-button { font-size:18px!important } .es-m-fw, .es-m-fw.es-fw, .es-m-fw .es-button { display:block!important } .es-m-il, .es-m-il .es-button, .es-social, .es-social td, .es-menu { display:inline-block!important } .es-adaptive table, .es-left, .es-right { width:100%!important } .es-content table, .es-header table, .es-footer table, .es-content, .es-footer, .es-header { width:100%!important; max-width:600px!important } .adapt-img { width:100%!important; height:auto!important } .es-mobile-hidden, .es-hidden { display:none!important } .es-desk-hidden { width:auto!important; overflow:visible!important; float:none!important; max-height:inherit!important; line-height:inherit!important } tr.es-desk-hidden { display:table-row!important } table.es-desk-hidden { display:table!important } td.es-desk-menu-hidden { display:table-cell!important } .es-menu td { width:1%!important } table.es-table-not-adapt, .esd-block-html table { width:auto!important } .es-social td { padding-bottom:10px } .h-auto { height:auto!important } a.es-button, button.es-button { display:inline-block!important } .es-button-border { display:inline-block!important } }</style></head>
-<body style="width:100%;height:100%;padding:0;Margin:0"><div class="es-wrapper-color" style="background-color:#FEFEFE"><!--[if gte mso 9]><v:background xmlns:v="urn:schemas-microsoft-com:vml" fill="t"> <v:fill type="tile" color="#fefefe"></v:fill> </v:background><![endif]--><table class="es-wrapper" width="100%" cellspacing="0" cellpadding="0" style="mso-table-lspace:0pt;mso-table-rspace:0pt;border-collapse:collapse;border-spacing:0px;padding:0;Margin:0;width:100%;height:100%;background-repeat:repeat;background-position:center top;background-color:#FEFEFE"><tr><td valign="top" style="padding:0;Margin:0"><table class="es-content" cellspacing="0" cellpadding="0" align="center" style="mso-table-lspace:0pt;mso-table-rspace:0pt;border-collapse:collapse;border-spacing:0px;width:100%;table-layout:fixed !important"><tr><td align="center" style="padding:0;Margin:0"><table class="es-content-body" cellspacing="0" cellpadding="0" bgcolor="#E6EAFE" align="center" style="mso-table-lspace:0pt;mso-table-rspace:0pt;border-collapse:collapse;border-spacing:0px;background-color:#E6EAFE;width:600px"><tr><td class="es-m-p20r es-m-p20l" align="left" bgcolor="#362081" style="Margin:0;padding-top:300px;padding-right:40px;padding-bottom:300px;padding-left:40px;background-color:#362081;border-radius:0;background-image:url(https://xnwpcz.stripocdn.email/content/guids/CABINET_ca1e7873db832290a5f716c68dd3b6188c9edc5a18866b3fdf75017ecedcd15c/images/ekran_privetstvia_YhE.jpg);background-repeat:no-repeat;background-position:left top;background-size:auto" background="https://xnwpcz.stripocdn.email/content/guids/CABINET_ca1e7873db832290a5f716c68dd3b6188c9edc5a18866b3fdf75017ecedcd15c/images/ekran_privetstvia_YhE.jpg"><table cellpadding="0" cellspacing="0" class="es-right" align="right" style="mso-table-lspace:0pt;mso-table-rspace:0pt;border-collapse:collapse;border-spacing:0px;float:right"><tr><td align="left" style="padding:0;Margin:0;width:520px"><table cellpadding="0" cellspacing="0" width="100%" role="presentation" style="mso-table-lspace:0pt;mso-table-rspace:0pt;border-collapse:collapse;border-spacing:0px"><tr><td align="left" style="padding:0;Margin:0"><div style="color:#fff;max-width:600px;margin:auto;height:inherit;display:flex;position:relative;justify-content:center;align-items:center;z-index:1000"><div style="background:#ABABAB51;backdrop-filter:blur(10px);border-radius:1rem;padding:1rem 2rem;transform:translateY(-20%)"><div style="font-family:roboto, 'helvetica neue', helvetica, arial, sans-serif;font-size:38px !important;line-height:57px !important">""" + text + """</div><div style="font-family:roboto, 'helvetica neue', helvetica, arial, sans-serif;font-size:32px !important;line-height:48px !important"> Ваш код: </div><div style="padding:1.5rem;text-align:center;font-weight:bold;letter-spacing:1.5rem;font-family:roboto, 'helvetica neue', helvetica, arial, sans-serif;font-size:3rem !important;line-height:150% !important;user-select:all">""" + code + """</div></div></div></td>
-</tr></table></td></tr></table></td></tr></table></td></tr></table></td></tr></table></div></body></html>
-    """
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except:
+            try:
+                server.close()
+            except:
+                metrics.swallowed("smtp.close")
 
-    # Compose message
-    msg = MIMEMultipart()
-    msg['From'] = sender
-    msg['To'] = ', '.join(addressees)
-    msg['Subject'] = theme
-    msg.attach(MIMEText(html, 'html'))
 
-    with smtplib.SMTP_SSL(host) as server:
-        server.login(sender, password)
-        server.sendmail(sender, addressees, msg.as_string())
+class MailTransport:
+    """Sends mail from worker threads so request handlers never wait on the SMTP server."""
+
+    def __init__(self, pool=None, queue=SMTP_QUEUE):
+        self.pool = pool or SMTPPool()
+        self._executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="smtp")
+        self._pending = threading.BoundedSemaphore(queue)
+
+    def _deliver(self, addressees, kwargs):
+        message = build_message(addressees, **kwargs)
+        self.pool.sendmail(SMTP_USER, addressees, message)
+
+    @contextmanager
+    def reserve(self):
+        """
+        Takes a queue slot up front, so MailQueueFull is raised before the caller stores anything.
+        Yields a send function for one message; the slot is freed once it is delivered, or on exit if
+        nothing was sent.
+        """
+        if not self._pending.acquire(blocking=False):
+            raise MailQueueFull()
+        sent = []
+
+        def send(addressees, **kwargs):
+            if sent:
+                raise RuntimeError("A reserved slot sends one message")
+            future = self._executor.submit(self._deliver, addressees, kwargs)
+            sent.append(future)
+            future.add_done_callback(lambda _: self._pending.release())
+            future.add_done_callback(metrics.report_failure("smtp.send"))
+            return future
+
+        try:
+            yield send
+        finally:
+            if not sent:
+                self._pending.release()
+
+    def send(self, addressees, **kwargs):
+        with self.reserve() as send:
+            return send(addressees, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+mail_templates.preload(SMTP_USER)
+mailer = MailTransport()
+
+
+def send_email(addressees, theme="Регистрация", code="5555", text="Спасибо за регистрацию", port=465):
+    message = build_message(addressees, theme=theme, code=code, text=text)
+    mailer.pool.sendmail(SMTP_USER, addressees, message)
 
 
 if __name__ == '__main__':
-    HOST = "smtp.yandex.ru"
-    SUBJECT = "Регистрация"
     TO = ["gemerdd@gmail.com"]
-    FROM = "Arthut1@yandex.ru"
-    password = "KarateCan120"
-    send_email(TO, FROM, SUBJECT, HOST, password)
+    send_email(TO)
@@ -0,0 +1,94 @@
+import asyncio
+import inspect
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Seconds each startup check may take before it counts as failed
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "30"))
+# Seconds between retries of a failed check
+STARTUP_RETRY = float(os.getenv("STARTUP_RETRY", "15"))
+
+PENDING, OK, FAILED, TIMEOUT = "pending", "ok", "failed", "timeout"
+
+logger = logging.getLogger(__name__)
+
+
+class StartupChecks:
+    """
+    Independent startup steps, each bounded by a timeout.
+
+    run() only waits for the required steps, concurrently; optional ones run in the background
+    from the start. A failed step does not stop the worker: it is retried until it passes.
+    The worker is ready once every required step has passed; optional ones are only reported.
+    """
+
+    def __init__(self, timeout=STARTUP_TIMEOUT, retry=STARTUP_RETRY):
+        self.timeout = timeout
+        self.retry = retry
+        self.status = {}
+        self._checks = {}
+        self._running = {}
+        self._tasks = []
+        self._executor = None
+
+    def add(self, name, fn, required=True):
+        """`fn` is a coroutine function, or a blocking function that is run on a startup thread."""
+        self._checks[name] = (fn, required)
+        self.status[name] = PENDING
+
+    def _start(self, name):
+        fn, _ = self._checks[name]
+        if inspect.iscoroutinefunction(fn):
+            return fn()
+        # A thread cannot be cancelled: after a timeout the next attempt waits for the same
+        # call instead of starting another one next to it
+        future = self._running.get(name)
+        if future is None or future.done():
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="startup")
+            future = self._running[name] = asyncio.get_running_loop().run_in_executor(self._executor, fn)
+        return asyncio.shield(future)
+
+    async def _attempt(self, name):
+        try:
+            await asyncio.wait_for(self._start(name), self.timeout)
+            self.status[name] = OK
+        except asyncio.TimeoutError:
+            metrics.swallowed(f"startup.{name}")
+            logger.warning("Startup check [%s] timed out after %ss", name, self.timeout)
+            self.status[name] = TIMEOUT
+        except Exception:
+            metrics.swallowed(f"startup.{name}")
+            logger.exception("Startup check [%s] failed", name)
+            self.status[name] = FAILED
+        return self.status[name] == OK
+
+    async def _keep_trying(self, name, delay=0.0):
+        await asyncio.sleep(delay)
+        while not await self._attempt(name):
+            await asyncio.sleep(self.retry)
+
+    async def run(self):
+        required = [name for name, (_, is_required) in self._checks.items() if is_required]
+        for name in self._checks:
+            if name not in required:
+                self._tasks.append(asyncio.create_task(self._keep_trying(name)))
+        passed = await asyncio.gather(*(self._attempt(name) for name in required))
+        for name, ok in zip(required, passed):
+            if not ok:
+                self._tasks.append(asyncio.create_task(self._keep_trying(name, self.retry)))
+
+    @property
+    def ready(self):
+        return all(self.status[name] == OK for name, (_, required) in self._checks.items() if required)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,26 @@
+import asyncio
+import httpx
+import pytest
+import main
+import numerology
+
+
+async def _post_batch(dates):
+    main.app.dependency_overrides[main.check_token] = lambda: None
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.post("/number/batch", json={"dates": dates})
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("dates", [["NaT"], ["2024-05-01", "NaT"]])
+def test_batch_rejects_nat(dates):
+    response = asyncio.run(_post_batch(dates))
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid date"}
+
+
+def test_digit_sums_rejects_negative_values():
+    with pytest.raises(ValueError):
+        numerology.digit_sums([-1])